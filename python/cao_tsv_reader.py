@@ -1,24 +1,32 @@
 #!/usr/bin/env python3
 
-import json
 import csv
 import argparse
+import sys
+from collections import Counter
 
+from json_writer import write_json
+from precision import round_values, summary
 
-def cells_dict(filename):
-    cells_dict = {}
+
+def cells_dict(filename, report=None):
     with open(filename) as file:
-        rows = csv.reader(file, delimiter='\t')
-        for row in rows:
-            id, x, y = row
-            cells_dict[id] = {
-                'mappings': {
-                    't-SNE': [float(x), float(y)]
-                },
-                'genes': {},
-                'factors': {},
-                'poly': []
-            }
+        rows = list(csv.reader(file, delimiter='\t'))
+    ids = [row[0] for row in rows]
+    tsne = round_values(
+        [row[1:] for row in rows], 'embedding', report
+    ).reshape(-1, 2)
+
+    cells_dict = {}
+    for (id, xy) in zip(ids, tsne.tolist()):
+        cells_dict[id] = {
+            'mappings': {
+                't-SNE': xy
+            },
+            'genes': {},
+            'factors': {},
+            'poly': []
+        }
 
     return cells_dict
 
@@ -34,5 +42,7 @@ if __name__ == '__main__':
         help='Write the cell data to this file.')
     args = parser.parse_args()
 
-    cells = cells_dict(args.tsv_tsne_file)
-    json.dump(cells, args.cells_file, indent=1)
+    report = Counter()
+    cells = cells_dict(args.tsv_tsne_file, report)
+    write_json(cells, args.cells_file, indent=1)
+    print(summary(report), file=sys.stderr)
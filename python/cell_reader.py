@@ -1,83 +1,28 @@
 #!/usr/bin/env python3
 
-import json
 import argparse
+import os
 import pickle
-from collections import defaultdict
+import sys
+from collections import Counter, defaultdict
 
 import numpy as np
-import pandas
+import zarr
 
 from loom_reader import LoomReader
-from cluster import cluster as get_clusters
-from delaunay import DictDelaunay2d
-from sklearn import decomposition
-
-
-def octagon(poly):
-    '''
-    Returns a bounding octagon.
-
-    >>> square = np.array([[0,0], [0,1], [1,1], [1,0]])
-    >>> octagon(square)
-    [[0, 0], [0, 1], [0, 1], [1, 1], [1, 1], [1, 0], [1, 0], [0, 0]]
-
-    >>> triangle = np.array([[1,0], [0,2], [2,3]])
-    >>> octagon(triangle)
-    [[0, 1], [0, 2], [1, 3], [2, 3], [2, 3], [2, 1], [1, 0], [1, 0]]
-
-    >>> type(octagon(triangle)[0][0])
-    <class 'int'>
-    '''
-    # SciPy has ConvexHull, but it segfaulted on me: perhaps
-    #   https://github.com/scipy/scipy/issues/9751
-    # ... and even if I fixed it locally,
-    # not sure we want that fragility.
-    #
-    # Also: The goal is really just to get a simplified shape...
-    # A convex hull is too precise in some ways,
-    # while in others it falls short, ie, concavities.
-    #
-    # I kind-of like the obvious artificiality of an octagon.
-
-    # Was unsigned, and substraction causes underflow.
-    poly_as_int = poly.astype('int')
-    min_x = int(np.min(poly_as_int[:, [0]]))
-    max_x = int(np.max(poly_as_int[:, [0]]))
-    min_y = int(np.min(poly_as_int[:, [1]]))
-    max_y = int(np.max(poly_as_int[:, [1]]))
-
-    summed = np.sum(poly_as_int, axis=1)
-    diffed = np.diff(poly_as_int, axis=1)
-
-    min_sum = int(np.min(summed))
-    max_sum = int(np.max(summed))
-    min_diff = int(np.min(diffed))
-    max_diff = int(np.max(diffed))
-
-    return [
-        [min_x, min_sum - min_x],
-        [min_x, max_diff + min_x],  # ^ Left
-        [max_y - max_diff, max_y],
-        [max_sum - max_y, max_y],  # ^ Botton
-        [max_x, max_sum - max_x],
-        [max_x, min_diff + max_x],  # ^ Right
-        [min_y - min_diff, min_y],
-        [min_sum - min_y, min_y]  # ^ Top
-    ]
-
-
-def mean_coord(coords):
-    '''
-    The xy values in the Linnarsson data are not good:
-    They take a different corner as the origin.
-    So... we find the center of our polygon instead.
-
-    >>> mean_coord([[1,2], [3,4], [5,6]])
-    [3, 4]
-
-    '''
-    return [int(x) for x in np.mean(coords, axis=0).tolist()]
+from cluster import (
+    heatmap as get_heatmap, heatmap_lists,
+    write_zarr as write_heatmap_zarr
+)
+from delaunay import Delaunay2d, TiledDelaunay2d
+from factor_encoder import extend_factor
+from json_writer import write_json, write_json_items
+from pca import MODES as PCA_MODES, principal_components
+from precision import round_values, summary as precision_summary
+from polygons import PolygonStore, write_levels_zarr
+from zarr_writer import write_arrays
+from scipy.sparse import issparse
+from scipy.spatial import cKDTree
 
 
 # Taken from http://linnarssonlab.org/osmFISH/clusters/
@@ -116,8 +61,46 @@ LOOKUP = {
 }
 
 
-def get_neighborhoods(metadata):
+def get_triangulation(metadata, tile_size=None, workers=1):
     '''
+    Triangulate the cells. With a tile_size, the plane is cut into tiles
+    which are triangulated in parallel by workers processes, and stitched
+    together. Returns the cell IDs, and the counter-clockwise triangles
+    as rows of indices into them.
+
+    >>> cells = {
+    ...   'O': { 'xy': [0,0], 'extra': 'field'},
+    ...   'N': { 'xy': [0,1], 'extra': 'field'},
+    ...   'E': { 'xy': [1,0], 'extra': 'field'},
+    ...   'S': { 'xy': [0,-1], 'extra': 'field'},
+    ...   'W': { 'xy': [-1,0], 'extra': 'field'}
+    ... }
+    >>> cell_ids, triangles = get_triangulation(cells)
+    >>> cell_ids
+    ['O', 'N', 'E', 'S', 'W']
+    >>> triangles.dtype
+    dtype('uint32')
+    >>> triangles.tolist()
+    [[0, 2, 1], [0, 1, 4], [0, 3, 2], [0, 4, 3]]
+    >>> get_triangulation(cells, tile_size=1)[1].tolist()
+    [[0, 2, 1], [0, 1, 4], [0, 3, 2], [0, 4, 3]]
+
+    '''
+    cell_ids = list(metadata.keys())
+    coords = [metadata[cell_id]['xy'] for cell_id in cell_ids]
+    if tile_size is None:
+        delaunay = Delaunay2d(coords)
+    else:
+        delaunay = TiledDelaunay2d(coords, tile_size, workers)
+    triangles = np.array(delaunay.getTriangles(), dtype=np.uint32)
+    return cell_ids, triangles.reshape(-1, 3)
+
+
+def get_neighborhoods(metadata, triangulation=None):
+    '''
+    Key each triangle by its cell IDs. The triangulation from
+    get_triangulation is computed, if not given.
+
     >>> cells = {
     ...   'O': { 'xy': [0,0], 'extra': 'field'},
     ...   'N': { 'xy': [0,1], 'extra': 'field'},
@@ -132,45 +115,190 @@ def get_neighborhoods(metadata):
     {'poly': [[0, 0], [1, 0], [0, 1]]}
 
     '''
-    coords = {}
-    for (k, v) in metadata.items():
-        coords[k] = v['xy']
-    triangles = DictDelaunay2d(coords).getTriangles()
+    cell_ids, triangles = triangulation or get_triangulation(metadata)
     neighborhoods = {}
-    for triangle in triangles:
-        key = '::'.join(triangle)
+    for triangle in triangles.tolist():
+        triangle_ids = [cell_ids[i] for i in triangle]
+        key = '::'.join(triangle_ids)
         value = {
-            'poly': [coords[point] for point in triangle]
+            'poly': [metadata[cell_id]['xy'] for cell_id in triangle_ids]
         }
         neighborhoods[key] = value
     return neighborhoods
 
 
-def get_genes(metadata):
+def get_csr(rows, cols, xy):
     '''
-    >>> metadata = {
-    ...   'cell-1': {'genes': {'a': 1, 'b': 20}},
-    ...   'cell-2': {'genes': {'a': 2, 'b': 10}}
-    ... }
-    >>> genes = get_genes(metadata)
+    Returns the (row, col) pairs as a CSR adjacency list over the cells
+    at xy: The neighbors of cell i are indices[indptr[i]:indptr[i + 1]],
+    in order, and distances holds their distances from cell i.
+
+    >>> xy = np.array([[0, 0], [3, 4], [0, 1]])
+    >>> indptr, indices, distances = get_csr(
+    ...     np.array([0, 0, 1]), np.array([2, 1, 0]), xy)
+    >>> indptr.tolist()
+    [0, 2, 3, 3]
+    >>> indices.tolist()
+    [1, 2, 0]
+    >>> distances.tolist()
+    [5.0, 1.0, 5.0]
+
+    '''
+    n = len(xy)
+    edges = np.unique(rows.astype(np.int64) * n + cols)
+    rows, cols = np.divmod(edges, n)
+    indptr = np.searchsorted(rows, np.arange(n + 1))
+    offsets = (xy[cols] - xy[rows]).astype(np.float64)
+    distances = np.sqrt((offsets * offsets).sum(axis=1))
+    return (
+        indptr.astype(np.uint32),
+        cols.astype(np.uint32),
+        distances.astype(np.float32)
+    )
+
+
+def get_delaunay_adjacency(triangles, xy):
+    '''
+    Returns the edges of the triangles as a CSR adjacency list.
+
+    >>> xy = np.array([[0, 0], [0, 1], [1, 0], [0, -1], [-1, 0]])
+    >>> triangles = np.array([[0, 2, 1], [0, 1, 4], [0, 3, 2], [0, 4, 3]])
+    >>> indptr, indices, distances = get_delaunay_adjacency(triangles, xy)
+    >>> indptr.tolist()
+    [0, 4, 7, 10, 13, 16]
+    >>> indices[indptr[0]:indptr[1]].tolist()
+    [1, 2, 3, 4]
+    >>> indices[indptr[1]:indptr[2]].tolist()
+    [0, 2, 4]
+
+    '''
+    start = triangles.ravel()
+    end = triangles[:, [1, 2, 0]].ravel()
+    return get_csr(
+        np.concatenate((start, end)), np.concatenate((end, start)), xy
+    )
+
+
+def get_knn_adjacency(xy, k):
+    '''
+    Returns the k nearest other cells of each cell as a CSR adjacency list.
+
+    >>> xy = np.array([[0, 0], [0, 1], [0, 3], [0, 3], [5, 5]])
+    >>> indptr, indices, distances = get_knn_adjacency(xy, 2)
+    >>> indptr.tolist()
+    [0, 2, 4, 6, 8, 10]
+    >>> indices.reshape(-1, 2).tolist()
+    [[1, 2], [0, 2], [1, 3], [1, 2], [2, 3]]
+
+    '''
+    k = min(k, len(xy) - 1)
+    if k < 1:
+        return get_csr(np.zeros(0), np.zeros(0), xy)
+    _, neighbors = cKDTree(xy).query(xy, k=k + 1)
+    rows = np.repeat(np.arange(len(xy)), k + 1).reshape(-1, k + 1)
+    # Each cell finds itself, unless k other cells are at the same point.
+    others = neighbors != rows
+    others[others.all(axis=1), -1] = False
+    return get_csr(rows[others], neighbors[others], xy)
+
+
+def get_radius_adjacency(xy, radius):
+    '''
+    Returns the other cells within radius of each cell as a CSR adjacency
+    list.
+
+    >>> xy = np.array([[0, 0], [0, 1], [0, 3], [5, 5]])
+    >>> indptr, indices, distances = get_radius_adjacency(xy, 2)
+    >>> indptr.tolist()
+    [0, 1, 3, 4, 4]
+    >>> indices.tolist()
+    [1, 0, 2, 1]
+    >>> distances.tolist()
+    [1.0, 1.0, 2.0, 2.0]
+
+    '''
+    pairs = cKDTree(xy).query_pairs(radius, output_type='ndarray')
+    start, end = pairs.T if len(pairs) else (np.zeros(0), np.zeros(0))
+    return get_csr(
+        np.concatenate((start, end)), np.concatenate((end, start)), xy
+    )
+
+
+def write_neighborhoods_zarr(path, cell_ids, triangles=None, adjacency=None):
+    '''
+    Write the triangles, and the CSR adjacency list with its distances,
+    as arrays in a zarr group, with the cell IDs they index as an
+    attribute. Each array is one uncompressed chunk, so the viewer can
+    fetch it with a single request and use it as is.
+    '''
+    arrays = {}
+    if triangles is not None:
+        arrays['triangles'] = triangles
+    if adjacency is not None:
+        arrays['indptr'], arrays['indices'], arrays['distances'] = adjacency
+    group = zarr.open_group(path, mode='w-')
+    write_arrays(group, arrays)
+    group.attrs['cells'] = cell_ids
+
+
+def get_genes(matrix, cell_ids, gene_ids):
+    '''
+    Given a cells-by-genes matrix, and the IDs of its rows and columns,
+    returns the maximum of each gene, and its value for each cell.
+    For a scipy.sparse matrix, only the stored values are listed.
+
+    >>> matrix = np.array([[1, 20], [2, 10]])
+    >>> genes = get_genes(matrix, ['cell-1', 'cell-2'], ['a', 'b'])
     >>> genes['a']
     {'max': 2, 'cells': {'cell-1': 1, 'cell-2': 2}}
     >>> genes['b']
     {'max': 20, 'cells': {'cell-1': 20, 'cell-2': 10}}
 
+    >>> from scipy import sparse
+    >>> matrix = sparse.csr_matrix([[1, 0], [0, 0]])
+    >>> genes = get_genes(matrix, ['cell-1', 'cell-2'], ['a', 'b'])
+    >>> genes['a']
+    {'max': 1, 'cells': {'cell-1': 1}}
+    >>> genes['b']
+    {'max': 0, 'cells': {}}
+
     '''
-    genes = defaultdict(lambda: {'max': 0, 'cells': {}})
-    for cell_id, cell_data in metadata.items():
-        for gene_id, expression_level in cell_data['genes'].items():
-            gene_data = genes[gene_id]
-            gene_data['cells'][cell_id] = expression_level
-            if gene_data['max'] < expression_level:
-                gene_data['max'] = expression_level
+    genes = {}
+    if not matrix.shape[0]:
+        maxima = [0] * len(gene_ids)
+    elif issparse(matrix):
+        matrix = matrix.tocsc()
+        matrix.sort_indices()
+        maxima = matrix.max(axis=0).toarray().ravel()
+    else:
+        matrix = np.asarray(matrix)
+        maxima = matrix.max(axis=0)
+    maxima = np.maximum(maxima, 0).tolist()
+
+    if issparse(matrix):
+        cell_ids = np.array(cell_ids, dtype=object)
+        for (column, gene_id) in enumerate(gene_ids):
+            column_slice = slice(*matrix.indptr[column:column + 2])
+            genes[gene_id] = {
+                'max': maxima[column],
+                'cells': dict(zip(
+                    cell_ids[matrix.indices[column_slice]].tolist(),
+                    matrix.data[column_slice].tolist()
+                ))
+            }
+    else:
+        for (column, gene_id) in enumerate(gene_ids):
+            genes[gene_id] = {
+                'max': maxima[column],
+                'cells': dict(zip(cell_ids, matrix[:, column].tolist()))
+            }
     return genes
 
 
-def get_factors(metadata):
+def get_factors(metadata, factors=None):
     '''
+    Given the factors from earlier batches of cells, these are extended.
+
     >>> metadata = {
     ...   "Santa's Little Helper": {'factors':{'eng': 'dog', 'sci': 'canine'}},
     ...   "Snowball II": {'factors':{'eng': 'cat', 'sci': 'feline'}}
@@ -183,18 +311,115 @@ def get_factors(metadata):
     >>> factors['eng']['cells']
     {"Santa's Little Helper": 0, 'Snowball II': 1}
 
+    >>> more = {'Laddie': {'factors':{'eng': 'dog', 'sci': 'canine'}}}
+    >>> factors = get_factors(more, factors)
+    >>> factors['eng']['cells']['Laddie']
+    0
+
     '''
-    factors = defaultdict(lambda: {'map': [], 'cells': {}})
-    for cell_id, cell_data in metadata.items():
-        for factor_id, factor_value in cell_data['factors'].items():
-            factor_data = factors[factor_id]
-            if factor_value not in factor_data['map']:
-                factor_data['map'].append(factor_value)
-            factor_index = factor_data['map'].index(factor_value)
-            factor_data['cells'][cell_id] = factor_index
+    if factors is None:
+        factors = defaultdict(lambda: {'map': [], 'cells': {}})
+    factor_ids = dict.fromkeys(
+        factor_id for cell_data in metadata.values()
+        for factor_id in cell_data['factors']
+    )
+    for factor_id in factor_ids:
+        cell_ids = [
+            cell_id for (cell_id, cell_data) in metadata.items()
+            if factor_id in cell_data['factors']
+        ]
+        extend_factor(factors[factor_id], cell_ids, [
+            metadata[cell_id]['factors'][factor_id] for cell_id in cell_ids
+        ])
     return factors
 
 
+def get_shapes(segmentation, cell_ids=None):
+    '''
+    Returns the bounding octagon of each cell in the segmentation,
+    a PolygonStore, and its center, for all at once: The xy values in the
+    Linnarsson data take a different corner as the origin, so the center
+    of the octagon is used instead, truncated to integers.
+    If cell IDs are given, only those are read.
+
+    >>> segmentation = PolygonStore.from_dict({
+    ...   '1': np.array([[0, 0], [0, 2], [2, 2], [2, 0]]),
+    ...   '2': np.array([[5, 5]])
+    ... })
+    >>> shapes = get_shapes(segmentation, ['1'])
+    >>> list(shapes.keys())
+    ['1']
+    >>> poly, xy = shapes['1']
+    >>> poly
+    [[0, 0], [0, 2], [0, 2], [2, 2], [2, 2], [2, 0], [2, 0], [0, 0]]
+    >>> from polygons import bounding_octagons
+    >>> bounds = segmentation.select(['1']).bounds()
+    >>> poly == bounding_octagons(bounds)[0].tolist()
+    True
+    >>> xy
+    [1, 1]
+    '''
+    if cell_ids is not None:
+        segmentation = segmentation.select(cell_ids)
+    octagons = segmentation.octagons()
+    # Truncated, like int()
+    centers = octagons.centroids().astype(np.int64)
+    return dict(zip(octagons.ids, zip(octagons.tolist(), centers.tolist())))
+
+
+def prepare_cells(metadata, shapes, integers=False, report=None):
+    '''
+    Replace each cell's cluster with its factors, take the shape and
+    position from get_shapes, if any, and round positions if asked.
+    The t-SNE, which is only drawn, is rounded as an embedding, and the
+    bytes saved are added to the report, if given.
+
+    >>> metadata = {
+    ...   '1': {'cluster': 'Pericytes', 'xy': [0.5, 1.5],
+    ...         'mappings': {'t-SNE': [-6.917154788970947, 16.6]}},
+    ...   '2': {'cluster': 'Microglia', 'xy': [2.5, 3.5],
+    ...         'mappings': {'t-SNE': [1, 2]}}
+    ... }
+    >>> shapes = {'1': ([[0, 0], [0, 2], [2, 2], [2, 0]], [1, 1])}
+    >>> prepare_cells(metadata, shapes, integers=True)
+    >>> metadata['1']['factors']
+    {'subcluster': 'Pericytes', 'cluster': 'Vasculature'}
+    >>> metadata['1']['xy']
+    [1, 1]
+    >>> metadata['2']['xy']
+    [2, 3]
+    >>> metadata['1']['mappings']['t-SNE']
+    [-6.9172, 16.6]
+    '''
+    cells = list(metadata.values())
+    if cells:
+        tsne = round_values(
+            [cell['mappings']['t-SNE'] for cell in cells], 'embedding', report
+        )
+        for (cell, pair) in zip(cells, tsne.tolist()):
+            cell['mappings']['t-SNE'] = pair
+
+    for cell in metadata.values():
+        # "Clusters" in the raw data are called "subclusters"
+        # in http://linnarssonlab.org/osmFISH/clusters/
+        subcluster = cell.pop('cluster')
+        cell['factors'] = {
+            'subcluster': subcluster,
+            'cluster': LOOKUP[subcluster]
+        }
+
+    for cell_id, cell in metadata.items():
+        if cell_id in shapes:
+            cell['poly'], cell['xy'] = shapes[cell_id]
+
+    if integers:
+        for cell in metadata.values():
+            cell['xy'] = [
+                # Raw data has way too many decimal points!
+                int(z) for z in cell['xy']
+            ]
+
+
 def get_cell_sets(clusters, lookup):
     '''
     >>> from collections import namedtuple
@@ -271,59 +496,80 @@ def get_cell_sets(clusters, lookup):
     return cell_sets
 
 
-def genes_to_samples_by_features(metadata):
+def get_pca(lr, batch_size=None, n_components=2, mode='full'):
     '''
-    >>> metadata = {
-    ...   '0': {
-    ...     'genes': {'A': 0, 'B': 0, 'A2': 0, 'B2': 0}
-    ...   },
-    ...   '1': {
-    ...     'genes': {'A': 0, 'B': 1, 'A2': 0, 'B2': 1}
-    ...   },
-    ...   '2': {
-    ...     'genes': {'A': 0, 'B': 4, 'A2': 0, 'B2': 4}
-    ...   }
-    ... }
-    >>> s_by_f = genes_to_samples_by_features(metadata)
-    >>> s_by_f.shape
-    (3, 4)
+    Returns the IDs of the valid cells in the LoomReader, and their
+    principal components, reading the matrix batch_size cells at a time,
+    or all at once.
+
+    >>> lr = LoomReader('fake-files/input/linnarsson/\
+linnarsson.cells.loom')
+    >>> cell_ids, pcs = get_pca(lr, 1000)
+    >>> pcs.shape
+    (4839, 2)
+    >>> pcs[cell_ids.index('42')].round(2).tolist()
+    [8.61, -13.43]
     '''
-    records = dict([(k, v['genes']) for k, v in metadata.items()])
-    return pandas.DataFrame.from_dict(records, orient='index')
+    batch_size = batch_size or max(len(lr.valid_cells), 1)
+
+    def batches():
+        return (matrix for (matrix, _, _) in lr.cell_batches(batch_size))
 
+    return (
+        lr.valid_cells,
+        principal_components(batches, n_components, mode)
+    )
 
-def add_pca(metadata):
+
+def add_pca(metadata, cell_ids, pcs, decimals=2):
     '''
-    >>> metadata = {
-    ...   '0': {
-    ...     'mappings': {},
-    ...     'genes': {'A': 0, 'B': 0, 'A2': 1, 'B2': 0}
-    ...   },
-    ...   '1': {
-    ...     'mappings': {},
-    ...     'genes': {'A': 1, 'B': 1, 'A2': 0, 'B2': 1}
-    ...   },
-    ...   '2': {
-    ...     'mappings': {},
-    ...     'genes': {'A': 0, 'B': 4, 'A2': 0, 'B2': 4}
-    ...   }
-    ... }
-    >>> add_pca(metadata)
+    Set the PCA mapping of each cell in metadata, rounded to decimals.
+
+    >>> metadata = {'0': {'mappings': {}}, '2': {'mappings': {}}}
+    >>> pcs = np.array([[-2.414, -0.57], [-0.92, 0.77], [3.333, -0.2]])
+    >>> add_pca(metadata, ['0', '1', '2'], pcs)
     >>> metadata['0']['mappings']['PCA']
     [-2.41, -0.57]
-    >>> metadata['1']['mappings']['PCA']
-    [-0.92, 0.77]
     >>> metadata['2']['mappings']['PCA']
     [3.33, -0.2]
     '''
-    pca = decomposition.PCA(n_components=2)
-    principle_components = pca.fit_transform(
-        genes_to_samples_by_features(metadata)
-    ).tolist()
-    for (k, pc) in zip(metadata.keys(), principle_components):
-        metadata[k]['mappings']['PCA'] = [
-            round(component, 2) for component in pc
-        ]
+    for (cell_id, pc) in zip(cell_ids, pcs.tolist()):
+        if cell_id in metadata:
+            metadata[cell_id]['mappings']['PCA'] = [
+                round(component, decimals) for component in pc
+            ]
+
+
+def get_batches(lr, batch_size, shapes, integers=False,
+                pca=None, decimals=2, report=None):
+    '''
+    Yields the cells of the LoomReader, as they are written,
+    batch_size cells at a time. The PCA mapping is set from the
+    cell IDs and principal components of get_pca, if given,
+    and the rest are prepared as prepare_cells does.
+
+    >>> lr = LoomReader('fake-files/input/linnarsson/\
+linnarsson.cells.loom')
+    >>> batches = get_batches(lr, 1000, {}, pca=get_pca(lr, 1000))
+    >>> batch = next(batches)
+    >>> len(batch)
+    1000
+    >>> sorted(next(iter(batch.values())).keys())
+    ['factors', 'genes', 'mappings', 'xy']
+    '''
+    if pca is not None:
+        cell_ids, pcs = pca
+        rows = {cell_id: row for (row, cell_id) in enumerate(cell_ids)}
+    for batch in lr.batches(batch_size):
+        if pca is not None:
+            batch_ids = list(batch.keys())
+            add_pca(
+                batch, batch_ids,
+                pcs[[rows[cell_id] for cell_id in batch_ids]],
+                decimals
+            )
+        prepare_cells(batch, shapes, integers, report)
+        yield batch
 
 
 if __name__ == '__main__':
@@ -336,9 +582,25 @@ if __name__ == '__main__':
     parser.add_argument(
         '--pkl', type=argparse.FileType('rb'),
         help='Pickle file with cell segmentation data')
+    parser.add_argument(
+        '--polygons',
+        help='Directory with the cell segmentation as a PolygonStore: '
+             'If it does not exist, the --pkl is converted to it, '
+             'and later runs can read it without the --pkl.')
+    parser.add_argument(
+        '--polygons_zarr',
+        help='Write the cell segmentation to this zarr store, at each '
+             'level of detail: full, hull, octagon, and centroid.')
     parser.add_argument(
         '--clusters_file', type=argparse.FileType('x'),
         help='Write the hierarchically clustered data to this file.')
+    parser.add_argument(
+        '--clusters_zarr',
+        help='Write the hierarchically clustered data to this zarr store, '
+             'quantized.')
+    parser.add_argument(
+        '--clusters_dtype', default='uint8', choices=['uint8', 'uint16'],
+        help='Quantize the values in the --clusters_zarr to this type.')
     parser.add_argument(
         '--cells_file', type=argparse.FileType('x'),
         help='Write the cleaned cell data to this file.')
@@ -351,79 +613,181 @@ if __name__ == '__main__':
     parser.add_argument(
         '--neighborhoods_file', type=argparse.FileType('x'),
         help='Write the cell neighborhoods to this file.')
+    parser.add_argument(
+        '--neighborhoods_zarr',
+        help='Write the cell neighborhoods to this zarr store, '
+             'as a buffer of triangles which index the cells.')
+    parser.add_argument(
+        '--neighborhoods_mode', default='delaunay',
+        choices=['delaunay', 'knn', 'radius'],
+        help='Define neighborhoods by Delaunay triangles, '
+             'or as the k nearest cells, or the cells within a radius.')
+    parser.add_argument(
+        '--neighborhoods_k', type=int, default=6,
+        help='Number of neighbors for "--neighborhoods_mode knn".')
+    parser.add_argument(
+        '--neighborhoods_radius', type=float,
+        help='Distance to neighbors for "--neighborhoods_mode radius".')
+    parser.add_argument(
+        '--neighborhoods_adjacency', action='store_true',
+        help='Also write Delaunay neighborhoods to the zarr store '
+             'as a CSR adjacency list.')
+    parser.add_argument(
+        '--neighborhoods_tile_size', type=float,
+        help='Triangulate neighborhoods in square tiles of this size, '
+             'in parallel.')
+    parser.add_argument(
+        '--neighborhoods_workers', type=int, default=1,
+        help='Number of processes which triangulate neighborhood tiles.')
     parser.add_argument(
         '--factors_file', type=argparse.FileType('x'),
         help='Write the cell factors to this file.')
     parser.add_argument(
         '--integers', action='store_true',
         help='Convert all numbers to integers.')
+    parser.add_argument(
+        '--pca_mode', default='full', choices=PCA_MODES,
+        help='Find the principal components exactly, incrementally, '
+             'or by randomized SVD.')
+    parser.add_argument(
+        '--pca_components', type=int, default=2,
+        help='Number of principal components in the PCA mapping.')
+    parser.add_argument(
+        '--pca_decimals', type=int, default=2,
+        help='Round the PCA mapping to this many decimal places.')
+    parser.add_argument(
+        '--batch_size', type=int,
+        help='Read and write this many cells at a time, rather than '
+             'holding all the data in memory.')
     args = parser.parse_args()
-
+    if args.polygons and not (args.pkl or os.path.exists(args.polygons)):
+        parser.error('--polygons does not exist yet: '
+                     'give the --pkl to convert')
+    if args.polygons_zarr and not (args.pkl or args.polygons):
+        parser.error('--polygons_zarr needs the --pkl or --polygons')
+    if args.batch_size and (args.clusters_file or args.clusters_zarr):
+        parser.error('Clusters need all the data in memory; '
+                     'they can not be used with --batch_size')
+    if args.neighborhoods_mode != 'delaunay' and args.neighborhoods_file:
+        parser.error(
+            '--neighborhoods_file only holds Delaunay neighborhoods; '
+            'use --neighborhoods_zarr')
+    if args.neighborhoods_mode == 'radius' and not args.neighborhoods_radius:
+        parser.error('--neighborhoods_mode radius needs '
+                     '--neighborhoods_radius')
+
+    report = Counter()
     lr = LoomReader(args.loom)
-    metadata = lr.data()
-    add_pca(metadata)
-
-    for cell in metadata.values():
-        # "Clusters" in the raw data are called "subclusters"
-        # in http://linnarssonlab.org/osmFISH/clusters/
-        subcluster = cell.pop('cluster')
-        cell['factors'] = {
-            'subcluster': subcluster,
-            'cluster': LOOKUP[subcluster]
-        }
-
-    if args.pkl:
-        segmentation = pickle.load(args.pkl)
-        for cell_id, poly in segmentation.items():
-            if cell_id in metadata:
-                simple_poly = octagon(poly)
-                xy = mean_coord(simple_poly)
-                metadata[cell_id]['poly'] = simple_poly
-                metadata[cell_id]['xy'] = xy
-
-    if args.integers:
-        for cell in metadata.values():
-            cell['xy'] = [
-                # Raw data has way too many decimal points!
-                int(z) for z in cell['xy']
-            ]
+    segmentation = None
+    if args.polygons:
+        if not os.path.exists(args.polygons):
+            PolygonStore.from_dict(pickle.load(args.pkl)).save(args.polygons)
+        segmentation = PolygonStore.load(args.polygons)
+    elif args.pkl:
+        segmentation = PolygonStore.from_dict(pickle.load(args.pkl))
+    shapes = {}
+    if segmentation is not None:
+        segmentation = segmentation.select(lr.valid_cells)
+        shapes = get_shapes(segmentation)
+
+    if args.polygons_zarr:
+        write_levels_zarr(args.polygons_zarr, segmentation)
+
+    pca = get_pca(lr, args.batch_size, args.pca_components, args.pca_mode)
+
+    if args.batch_size:
+        # Only positions are kept for every cell, for the neighborhoods.
+        metadata = {}
+        factors = get_factors({})
+
+        def cell_items():
+            for batch in get_batches(
+                    lr, args.batch_size, shapes, args.integers,
+                    pca, args.pca_decimals, report):
+                get_factors(batch, factors)
+                for (cell_id, cell) in batch.items():
+                    metadata[cell_id] = {'xy': cell['xy']}
+                yield from batch.items()
+
+        if args.cells_file:
+            write_json_items(cell_items(), args.cells_file, indent=1)
+        else:
+            for _ in cell_items():
+                pass
+    else:
+        metadata = lr.data()
+        add_pca(metadata, *pca, decimals=args.pca_decimals)
+        prepare_cells(metadata, shapes, args.integers, report)
+        factors = get_factors(metadata)
 
-    if args.cells_file:
-        json.dump(metadata, args.cells_file, indent=1)
+        if args.cells_file:
+            write_json(metadata, args.cells_file, indent=1)
 
     if args.cell_sets_file:
         clusters = lr.clusters()
         cell_sets = get_cell_sets(clusters, LOOKUP)
-        json.dump(cell_sets, args.cell_sets_file, indent=1)
+        write_json(cell_sets, args.cell_sets_file, indent=1)
+
+    if args.clusters_file or args.clusters_zarr:
+        heatmap = get_heatmap(metadata)
+
+    if args.clusters_zarr:
+        write_heatmap_zarr(args.clusters_zarr, heatmap, args.clusters_dtype)
 
     if args.clusters_file:
-        clusters = get_clusters(metadata)
-        clusters_json = json.dumps(clusters)
         # Line-break after every element is too much, but this works:
-        spaced_clusters_json = clusters_json.replace(
-            '],',
-            '],\n'
+        write_json(
+            heatmap_lists(heatmap), args.clusters_file,
+            after='],', end='\n'
+        )
+
+    if args.genes_file and args.batch_size:
+        # As many values per batch of genes as per batch of cells.
+        gene_batch_size = max(
+            1, args.batch_size * len(lr.genes) // max(1, len(metadata))
         )
-        print(spaced_clusters_json, file=args.clusters_file)
-
-    if args.genes_file:
-        genes = get_genes(metadata)
-        genes_json = json.dumps(genes)
-        spaced_genes_json = genes_json.replace(
-            '},',
-            '},\n'
+        write_json_items(
+            (
+                item for batch in lr.gene_batches(gene_batch_size)
+                for item in get_genes(*batch).items()
+            ),
+            args.genes_file, after='},', end='\n'
+        )
+    elif args.genes_file:
+        write_json(
+            get_genes(*lr.matrix()), args.genes_file, after='},', end='\n'
         )
-        print(spaced_genes_json, file=args.genes_file)
 
     if args.factors_file:
-        factors = get_factors(metadata)
-        factors_json = json.dumps(factors)
-        spaced_factors_json = factors_json.replace(
-            '},',
-            '},\n'
+        write_json(factors, args.factors_file, after='},', end='\n')
+
+    if args.neighborhoods_mode == 'delaunay' and (
+            args.neighborhoods_file or args.neighborhoods_zarr):
+        triangulation = get_triangulation(
+            metadata,
+            tile_size=args.neighborhoods_tile_size,
+            workers=args.neighborhoods_workers
         )
-        print(spaced_factors_json, file=args.factors_file)
 
     if args.neighborhoods_file:
-        neighborhoods = get_neighborhoods(metadata)
-        json.dump(neighborhoods, args.neighborhoods_file)
+        neighborhoods = get_neighborhoods(metadata, triangulation)
+        write_json(neighborhoods, args.neighborhoods_file)
+
+    if args.neighborhoods_zarr:
+        cell_ids = list(metadata.keys())
+        xy = np.array([metadata[cell_id]['xy'] for cell_id in cell_ids])
+        triangles = None
+        adjacency = None
+        if args.neighborhoods_mode == 'delaunay':
+            triangles = triangulation[1]
+            if args.neighborhoods_adjacency:
+                adjacency = get_delaunay_adjacency(triangles, xy)
+        elif args.neighborhoods_mode == 'knn':
+            adjacency = get_knn_adjacency(xy, args.neighborhoods_k)
+        else:
+            adjacency = get_radius_adjacency(xy, args.neighborhoods_radius)
+        write_neighborhoods_zarr(
+            args.neighborhoods_zarr, cell_ids, triangles, adjacency
+        )
+
+    print(precision_summary(report), file=sys.stderr)
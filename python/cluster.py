@@ -1,11 +1,25 @@
 from scipy.cluster.hierarchy import leaves_list, linkage
+from scipy.spatial.distance import cdist
+import numpy as np
 import pandas as pd
+import zarr
+
+from zarr_writer import write_arrays
 
 # I found this tutorial very helpful:
 # https://joernhees.de/blog/2015/08/26/scipy-hierarchical-clustering-and-dendrogram-tutorial/
 
+# Ward linkage needs the distance between every pair of labels:
+# Past this many, only a sample is clustered, and the rest are placed
+# next to their nearest sampled label.
+LINKAGE_LIMIT = 5000
+# Number of labels to find the nearest sampled label for at once.
+CHUNK_SIZE = 1000
+# Rows and columns in each chunk of the quantized heatmap.
+ZARR_CHUNKS = (256, 4096)
+
 
-def _order_rows(dataframe):
+def _order_rows(dataframe, limit=LINKAGE_LIMIT):
     '''
     >>> df = pd.DataFrame({
     ...   'cell-1': {'a':8, 'b':1, 'c': 7, 'd': 2},
@@ -15,9 +29,13 @@ def _order_rows(dataframe):
     ... })
     >>> _order_rows(df)
     ['a', 'c', 'b', 'd']
+    >>> _order_rows(df, limit=2)
+    ['c', 'a', 'd', 'b']
 
     '''
     row_labels = dataframe.index.tolist()
+    if len(row_labels) > limit:
+        return _order_rows_by_sample(dataframe, limit)
     if len(row_labels) > 1:
         rows_linkage = linkage(dataframe, 'ward')
         rows_order = leaves_list(rows_linkage).tolist()
@@ -26,7 +44,45 @@ def _order_rows(dataframe):
         return row_labels
 
 
-def _order(dataframe):
+def _order_rows_by_sample(dataframe, size):
+    '''
+    Cluster a sample of the rows, and place each row after the sampled row
+    nearest to it: Memory is proportional to the sample size squared,
+    rather than the number of rows squared.
+
+    >>> df = pd.DataFrame({
+    ...   'cell-1': {'a':8, 'b':1, 'c': 7, 'd': 2, 'e': 9},
+    ...   'cell-2': {'a':1, 'b':1, 'c': 1, 'd': 1, 'e': 1},
+    ...   'cell-3': {'a':9, 'b':1, 'c': 8, 'd': 2, 'e': 8}
+    ... })
+    >>> _order_rows_by_sample(df, 3)
+    ['b', 'd', 'a', 'e', 'c']
+    '''
+    row_labels = dataframe.index.tolist()
+    values = dataframe.values.astype(np.float64)
+    sample = np.sort(
+        np.random.RandomState(0).choice(len(values), size, replace=False)
+    )
+    centroids = values[sample]
+    sample_order = np.empty(size, dtype=np.int64)
+    sample_order[leaves_list(linkage(centroids, 'ward'))] = np.arange(size)
+
+    nearest = np.empty(len(values), dtype=np.int64)
+    distances = np.empty(len(values))
+    for start in range(0, len(values), CHUNK_SIZE):
+        chunk = cdist(
+            values[start:start + CHUNK_SIZE], centroids, 'sqeuclidean'
+        )
+        chunk_nearest = chunk.argmin(axis=1)
+        nearest[start:start + CHUNK_SIZE] = chunk_nearest
+        distances[start:start + CHUNK_SIZE] = chunk[
+            np.arange(len(chunk)), chunk_nearest
+        ]
+    order = np.lexsort((distances, sample_order[nearest]))
+    return [row_labels[i] for i in order]
+
+
+def _order(dataframe, limit=LINKAGE_LIMIT):
     '''
     >>> df = pd.DataFrame({
     ...   'cell-1': {'a':8, 'b':1, 'c': 7},
@@ -39,8 +95,8 @@ def _order(dataframe):
     ['cell-2', 'cell-1', 'cell-3']
 
     '''
-    col_label_order = _order_rows(dataframe.T)
-    row_label_order = _order_rows(dataframe)
+    col_label_order = _order_rows(dataframe.T, limit)
+    row_label_order = _order_rows(dataframe, limit)
     return {'rows': row_label_order, 'cols': col_label_order}
 
 
@@ -85,7 +141,40 @@ def _row_norm(df):
     return (t / t.max()).T
 
 
-def cluster(cells):
+def heatmap(cells, limit=LINKAGE_LIMIT):
+    '''
+    Returns the cells' genes, with both ordered by clustering,
+    normalized so the greatest value of each gene is 1.
+
+    >>> cells = {
+    ...   'cell-1': { 'genes': {'a':8, 'b':2, 'c': 7}, 'extra': 'field'},
+    ...   'cell-2': { 'genes': {'a':1, 'b':1, 'c': 1}, 'extra': 'field'},
+    ...   'cell-3': { 'genes': {'a':10, 'b':2, 'c': 10}, 'extra': 'field'}
+    ... }
+    >>> heatmap(cells)
+       cell-2  cell-1  cell-3
+    b     0.5     1.0     1.0
+    a     0.1     0.8     1.0
+    c     0.1     0.7     1.0
+    '''
+    df = _to_dataframe(cells)
+    rows_cols = _order(df, limit)
+    clustered = df[rows_cols['cols']].loc[rows_cols['rows']]
+    return _row_norm(clustered)
+
+
+def heatmap_lists(dataframe):
+    '''
+    Returns the labels and the values of a heatmap, as lists.
+    '''
+    return {
+        'rows': dataframe.index.tolist(),
+        'cols': dataframe.columns.tolist(),
+        'matrix': dataframe.round(3).values.tolist()
+    }
+
+
+def cluster(cells, limit=LINKAGE_LIMIT):
     '''
     >>> cells = {
     ...   'cell-1': { 'genes': {'a':8, 'b':2, 'c': 7}, 'extra': 'field'},
@@ -100,12 +189,51 @@ def cluster(cells):
     >>> clustered['matrix']
     [[0.5, 1.0, 1.0], [0.1, 0.8, 1.0], [0.1, 0.7, 1.0]]
 
+    Past the limit, a sample of that many cells or genes is clustered:
+
+    >>> cluster(cells, limit=2)['cols']
+    ['cell-2', 'cell-3', 'cell-1']
+
     '''
-    df = _to_dataframe(cells)
-    rows_cols = _order(df)
-    clustered = df[rows_cols['cols']].loc[rows_cols['rows']]
-    return {
-        'rows': rows_cols['rows'],
-        'cols': rows_cols['cols'],
-        'matrix': _row_norm(clustered).round(3).values.tolist()
-    }
+    return heatmap_lists(heatmap(cells, limit))
+
+
+def quantize(matrix, dtype='uint8'):
+    '''
+    Map values from 0 to 1 onto the integers of an unsigned dtype.
+    Missing values are 0.
+
+    >>> quantize(np.array([[0, 0.5, 1], [np.nan, 0.25, 1]]))
+    array([[  0, 128, 255],
+           [  0,  64, 255]], dtype=uint8)
+    >>> quantize(np.array([0.5]), 'uint16')
+    array([32768], dtype=uint16)
+    '''
+    top = np.iinfo(dtype).max
+    return np.rint(np.nan_to_num(matrix) * top).astype(dtype)
+
+
+def write_zarr(path, dataframe, dtype='uint8'):
+    '''
+    Write a heatmap to a zarr store: The values quantized as a "matrix",
+    chunked along both axes, and its labels as "rows" and "cols" attributes.
+    Values are decoded by multiplying by the "scale" attribute.
+
+    >>> import os, tempfile
+    >>> df = pd.DataFrame({'cell-1': {'a': 0.5}, 'cell-2': {'a': 1.0}})
+    >>> path = os.path.join(tempfile.mkdtemp(), 'clusters.zarr')
+    >>> write_zarr(path, df)
+    >>> group = zarr.open_group(path, mode='r')
+    >>> group['matrix'][:]
+    array([[128, 255]], dtype=uint8)
+    >>> group.attrs['rows'], group.attrs['cols']
+    (['a'], ['cell-1', 'cell-2'])
+    >>> round(group['matrix'][0, 0] * group.attrs['scale'], 3)
+    0.502
+    '''
+    matrix = quantize(dataframe.values, dtype)
+    group = zarr.open_group(path, mode='w-')
+    write_arrays(group, [('matrix', matrix)], chunks=ZARR_CHUNKS)
+    group.attrs['rows'] = dataframe.index.tolist()
+    group.attrs['cols'] = dataframe.columns.tolist()
+    group.attrs['scale'] = 1 / np.iinfo(dtype).max
@@ -2,9 +2,20 @@
 
 import argparse
 import json
+import os
+import sys
+from multiprocessing import Pool
 
+import numpy as np
 from h5py import File
 
+from molecules import (
+    write_density_zarr, write_molecules_zarr, write_tiles_zarr
+)
+
+# Molecules to read and format at once.
+SLICE_SIZE = 1 << 20
+
 
 class CountsHdf5Reader:
     def __init__(self, filename):
@@ -35,6 +46,101 @@ class CountsHdf5Reader:
         '''
         return (list(pair) for pair in self.data[key])
 
+    def slices(self, slice_size=SLICE_SIZE):
+        '''
+        Returns (key, start, stop) for each slice of each dataset,
+        in order of the keys: At least one for each key, though it may
+        be empty.
+        '''
+        return [
+            (key, start, min(start + slice_size, len(self.data[key])))
+            for key in self.keys()
+            for start in range(0, max(len(self.data[key]), 1), slice_size)
+        ]
+
+    def batches(self, slice_size=SLICE_SIZE):
+        '''
+        Returns an iterator over (key, array) for each slice, so that
+        only one slice of the molecules is read into memory at a time.
+        '''
+        return (
+            (key, self.data[key][start:stop])
+            for (key, start, stop) in self.slices(slice_size)
+        )
+
+
+def format_pairs(pairs):
+    '''
+    Returns the pairs as json.dumps would write each one, a line apiece,
+    converting the arrays of numbers to text all at once.
+
+    >>> print(format_pairs(np.array([[18215.0, 20052.0], [-3.0, 7.0]])))
+    [18215.0, 20052.0],
+    [-3.0, 7.0]
+    >>> print(format_pairs(np.array([[0.5, 1e+20], [-0.0, 2.0]])))
+    [0.5, 1e+20],
+    [-0.0, 2.0]
+    >>> format_pairs(np.zeros((0, 2)))
+    ''
+    '''
+    values = np.asarray(pairs, dtype=np.float64).reshape(-1, 2)
+    integral = (
+        np.all(np.mod(values, 1) == 0)
+        and np.all(np.abs(values) < 1e16)
+        and not np.any(np.signbit(values) & (values == 0))
+    )
+    if integral:
+        # Most coordinates are whole numbers, which are quicker as integers.
+        text = np.char.add(values.astype(np.int64).astype(str), '.0')
+    else:
+        text = np.char.mod('%r', values)
+    lines = np.char.add(
+        np.char.add(np.char.add('[', text[:, 0]), ', '),
+        np.char.add(text[:, 1], ']')
+    )
+    return ',\n'.join(lines.tolist())
+
+
+_reader = None
+
+
+def _open(filename):
+    global _reader
+    _reader = CountsHdf5Reader(filename)
+
+
+def _format_slice(task):
+    (key, start, stop) = task
+    return format_pairs(_reader.data[key][start:stop])
+
+
+def write_molecules_json(filename, json_file, workers=1,
+                         slice_size=SLICE_SIZE):
+    '''
+    Write the molecules as JSON, one pair per line, as each slice is ready.
+    Slices are formatted in parallel by the workers, and written in order.
+    '''
+    tasks = CountsHdf5Reader(filename).slices(slice_size)
+    if workers > 1:
+        with Pool(workers, _open, (filename,)) as pool:
+            _write_slices(tasks, pool.imap(_format_slice, tasks), json_file)
+    else:
+        _open(filename)
+        _write_slices(tasks, map(_format_slice, tasks), json_file)
+
+
+def _write_slices(tasks, texts, json_file):
+    json_file.write('{\n')
+    for ((key, start, _), text) in zip(tasks, texts):
+        if start == 0:
+            if key != tasks[0][0]:
+                json_file.write('],\n')
+            json_file.write(json.dumps(key) + ':[\n')
+        else:
+            json_file.write(',\n')
+        json_file.write(text)
+    json_file.write(']}' if tasks else '}')
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -42,25 +148,33 @@ if __name__ == '__main__':
     parser.add_argument(
         '--hdf5', required=True,
         help='HDF5 file with molecule locations')
+    parser.add_argument(
+        '--workers', type=int, default=os.cpu_count(),
+        help='Format the molecules in this many processes.')
+    parser.add_argument(
+        '--zarr',
+        help='Write the molecules to this zarr store, '
+             'rather than JSON to stdout.')
+    parser.add_argument(
+        '--tiles_zarr',
+        help='Write the molecules to this zarr store as a tile pyramid, '
+             'rather than JSON to stdout.')
+    parser.add_argument(
+        '--density_zarr',
+        help='Write the number of molecules of each gene in each pixel '
+             'to this zarr image pyramid, rather than JSON to stdout.')
     args = parser.parse_args()
 
-    reader = CountsHdf5Reader(args.hdf5)
+    if args.density_zarr or args.zarr or args.tiles_zarr:
+        reader = CountsHdf5Reader(args.hdf5)
+        if args.zarr:
+            write_molecules_zarr(args.zarr, reader.batches)
+        if args.tiles_zarr:
+            write_tiles_zarr(args.tiles_zarr, reader.batches)
+        if args.density_zarr:
+            write_density_zarr(args.density_zarr, reader.batches)
+        sys.exit()
+
     # Doing the serialization by hand so we get immediate output,
     # and don't need an extra intermediate object
-    print('{')
-    first_key = True
-    for key in reader.keys():
-        if first_key:
-            first_key = False
-        else:
-            print(',')
-        print(json.dumps(key) + ':[')
-        first_pair = True
-        for pair in reader[key]:
-            if first_pair:
-                first_pair = False
-            else:
-                print(',')
-            print(json.dumps(pair), end='')
-        print(']', end='')
-    print('}', end='')
+    write_molecules_json(args.hdf5, sys.stdout, args.workers)
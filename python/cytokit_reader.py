@@ -1,37 +1,157 @@
 #!/usr/bin/env python3
 import csv
 import argparse
-import json
+import io
+import os
+from multiprocessing import Pool
 
+import numpy as np
+import pandas as pd
 
-def round_conv(s):
-    # TODO: Truncating after decimal point might be slightly too aggressive?
-    return round(float(s))
+from json_writer import write_json
 
+# Files larger than this are split by byte range across the workers.
+SPLIT_SIZE = 64 * 1024 * 1024
 
-def row_to_dict(row):
-    '''
-    >>> row = {
-    ...        'id': '123', 'x': '1.2', 'y': '3.4',
-    ...        'ci:ABC:mean': '5.6', 'ni:XYZ:mean': '7.8',
-    ...        'ci:EMPTY:mean': '9.0'
-    ... }
-    >>> row_to_dict(row)
-    {'xy': [1, 3], 'genes': {'ci:ABC': 6, 'ni:XYZ': 8}}
+
+def marker_columns(header):
     '''
+    Given the header, returns the columns of marker intensities,
+    and the name of each marker.
 
-    data_col_names = [
-        k for k in row.keys()
+    >>> marker_columns([
+    ...     'id', 'x', 'y',
+    ...     'ci:ABC:mean', 'ni:XYZ:mean', 'ci:EMPTY:mean', 'cm:size'
+    ... ])
+    (['ci:ABC:mean', 'ni:XYZ:mean'], ['ci:ABC', 'ni:XYZ'])
+    '''
+    columns = [
+        k for k in header
         if k[:2] in {'ni', 'ci'} and 'EMPTY' not in k
     ]
-    return {
-        'xy': [round_conv(xy) for xy in [row['x'], row['y']]],
-        'genes': {
-            k.replace(':mean', ''): round_conv(row[k])
-            # Each one has ":mean", so remove.
-            for k in data_col_names
-        }
-    }
+    # Each one has ":mean", so remove.
+    return columns, [k.replace(':mean', '') for k in columns]
+
+
+def read_cells(csv_file, columns):
+    '''
+    Returns the ID of each cell, its [x, y], and its value for each
+    of the columns, with the numbers rounded all at once.
+
+    >>> csv_file = io.StringIO(
+    ...     'id,x,y,ci:ABC:mean,ni:XYZ:mean\\n'
+    ...     '123,1.2,3.4,5.6,7.8\\n'
+    ...     '007,2.5,3.5,-0.6,0\\n'
+    ... )
+    >>> cell_ids, xy, values = read_cells(
+    ...     csv_file, ['ci:ABC:mean', 'ni:XYZ:mean'])
+    >>> cell_ids
+    ['123', '007']
+    >>> xy.tolist()
+    [[1, 3], [2, 4]]
+    >>> values.tolist()
+    [[6, 8], [-1, 0]]
+
+    As round() would, values which are missing, or not finite, raise:
+
+    >>> read_cells(io.StringIO(
+    ...     'id,x,y,ci:ABC:mean\\n'
+    ...     '123,1.2,3.4,nan\\n'
+    ... ), ['ci:ABC:mean'])
+    Traceback (most recent call last):
+    ...
+    ValueError: Cell 123 has no number for ci:ABC:mean: nan
+    >>> read_cells(io.StringIO(
+    ...     'id,x,y,ci:ABC:mean\\n'
+    ...     '123,1.2,,5.6\\n'
+    ... ), ['ci:ABC:mean'])
+    Traceback (most recent call last):
+    ...
+    ValueError: could not convert string to float: ...
+    '''
+    df = pd.read_csv(
+        csv_file, usecols=['id', 'x', 'y'] + columns,
+        dtype={'id': str}, na_filter=False,
+        # Parse as float() would, so that rounding matches it.
+        float_precision='round_trip'
+    )
+    values = df[['x', 'y'] + columns].values.astype(np.float64)
+    finite = np.isfinite(values)
+    if not finite.all():
+        (row, col) = np.argwhere(~finite)[0]
+        raise ValueError('Cell {} has no number for {}: {}'.format(
+            df['id'].iloc[row], (['x', 'y'] + columns)[col], values[row, col]
+        ))
+    # TODO: Truncating after decimal point might be slightly too aggressive?
+    # np.round, like round, rounds halves to even.
+    rounded = np.round(values).astype(np.int64)
+    return df['id'].tolist(), rounded[:, :2], rounded[:, 2:]
+
+
+def byte_ranges(path, parts):
+    '''
+    Returns the header line, and the start and end of about equal ranges
+    of the lines after it, each ending at a line break.
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'cells.csv')
+    >>> with open(path, 'w') as csv_file:
+    ...     _ = csv_file.write('id,x\\n1,10\\n2,20\\n3,30\\n4,40\\n')
+    >>> byte_ranges(path, 2)
+    (b'id,x\\n', [(5, 15), (15, 25)])
+    >>> byte_ranges(path, 20)[1][:3]
+    [(5, 10), (10, 15), (15, 20)]
+    '''
+    with open(path, 'rb') as csv_file:
+        header = csv_file.readline()
+        size = os.fstat(csv_file.fileno()).st_size
+        starts = [csv_file.tell()]
+        for part in range(1, parts):
+            middle = len(header) + (size - len(header)) * part // parts
+            # The range continues to the end of the line before the middle,
+            # which may be the line break just before it.
+            csv_file.seek(max(starts[-1], middle - 1))
+            csv_file.readline()
+            starts.append(csv_file.tell())
+    ranges = zip(starts, starts[1:] + [size])
+    return header, [(start, end) for (start, end) in ranges if start < end]
+
+
+def _read_range(task):
+    (path, header, start, end, columns) = task
+    with open(path, 'rb') as csv_file:
+        csv_file.seek(start)
+        lines = csv_file.read(end - start)
+    return read_cells(io.BytesIO(header + lines), columns)
+
+
+def cells_dict(path, workers=1, split_size=SPLIT_SIZE):
+    '''
+    Returns the position and marker values of each cell. Large files
+    are read in parts, by the workers.
+    '''
+    with open(path) as csv_file:
+        (columns, markers) = marker_columns(next(csv.reader(csv_file)))
+
+    if workers > 1 and os.path.getsize(path) > split_size:
+        (header, ranges) = byte_ranges(path, workers)
+        with Pool(workers) as pool:
+            parts = pool.map(_read_range, [
+                (path, header, start, end, columns)
+                for (start, end) in ranges
+            ])
+    else:
+        parts = [read_cells(path, columns)]
+
+    cells = {}
+    for (cell_ids, xy, values) in parts:
+        for (cell_id, position, row) in zip(
+                cell_ids, xy.tolist(), values.tolist()):
+            cells[cell_id] = {
+                'xy': position,
+                'genes': dict(zip(markers, row))
+            }
+    return cells
 
 
 if __name__ == '__main__':
@@ -43,15 +163,14 @@ if __name__ == '__main__':
     parser.add_argument(
         '--cells_file', type=argparse.FileType('x'),
         help='Write the cleaned cell data to this file.')
+    parser.add_argument(
+        '--workers', type=int, default=os.cpu_count(),
+        help='Read large files in this many processes.')
     # TODO: Neighborhood information is also in this file.
     # parser.add_argument(
     #     '--neighborhoods_file', type=argparse.FileType('x'),
     #     help='Write the cell neighborhoods to this file.')
     args = parser.parse_args()
 
-    cells = {}
-    with open(args.cytokit) as csv_file:
-        for row in csv.DictReader(csv_file):
-            cells[row['id']] = row_to_dict(row)
-
-    json.dump(cells, args.cells_file, indent=1)
+    cells = cells_dict(args.cytokit, args.workers)
+    write_json(cells, args.cells_file, indent=1)
@@ -1,15 +1,24 @@
-# MIT License; Copied from:
-# http://code.activestate.com/recipes/579021-delaunay-triangulation/
+# Sweep-hull Delaunay triangulation:
+#   Sinclair, "S-hull: a fast radial sweep-hull routine for Delaunay
+#   triangulation" (http://www.s-hull.org/paper/s_hull.pdf)
+# with the flat half-edge layout popularized by
+#   https://github.com/mapbox/delaunator
 #
-# (I've had trouble with scipy.spatial,
-# so going with pure Python even if it's slower.)
+# (I've had trouble with scipy.spatial, so this stays pure Python + numpy.
+# It replaces the recipe from
+# http://code.activestate.com/recipes/579021-delaunay-triangulation/
+# which stored everything in dicts and lists of tiny arrays,
+# and needed about 30 seconds for 1000 points.)
 
 # Ignore long lines:
 # flake8: noqa: E501
 
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy
-import math
-import copy
+
+from predicates import incircle, incircle_error
 
 
 class DictDelaunay2d:
@@ -26,14 +35,17 @@ class DictDelaunay2d:
     >>> points = {'A':[0,0], 'B':[1,2], 'C':[2,1], 'D':[1,3], 'E':[3,1], 'F':[3,3]}
     >>> delaunay = DictDelaunay2d(points)
     >>> delaunay.getTriangles()
-    [['B', 'C', 'F'], ['B', 'F', 'D'], ['C', 'F', 'E'], ['B', 'A', 'C'], ['C', 'A', 'E'], ['B', 'D', 'A']]
+    [['A', 'C', 'B'], ['A', 'B', 'D'], ['A', 'E', 'C'], ['B', 'C', 'F'], ['B', 'F', 'D'], ['C', 'E', 'F']]
 
     '''
-    def __init__(self, pairs_dict):
+    def __init__(self, pairs_dict, tileSize=None, workers=1):
         items = pairs_dict.items()
         self.keys = [item[0] for item in items]
         pairs = [item[1] for item in items]
-        self.delaunay = Delaunay2d(pairs)
+        if tileSize is None:
+            self.delaunay = Delaunay2d(pairs)
+        else:
+            self.delaunay = TiledDelaunay2d(pairs, tileSize, workers)
 
     def getTriangles(self):
         triangles = self.delaunay.getTriangles()
@@ -46,15 +58,26 @@ class Delaunay2d:
     The method involves ordering the points in increasing distance from the cloud's center of
     gravity, creating a triangle with the first three points, and adding the remaining points while
     contructing triangles between the point and boundary edges - only triangles with a definite sign
-    need to be added (the edge must be visible). Finally, an edge flipping step ensures that the
-    triangles are well formed, i.e. the sum of opposite angles to an edge is < 180 degree (the
-    so-called Delaunay criterion). It takes about 30 seconds to triangulate 1000 points, most of the
-    time is spent in two methods (flipOneEdge and getArea).
-
-    Further improvements could include adding support for holes and automatically adding Steiner
-    points. Generally speaking, triangles which have an edge on the boundary (convex hull), tend to
-    be squashed; this problem can be alleviated by adding more points on the boundary. Holes can be
-    treaded by removing triangles, edges, and points that are contained inside a given closed path.
+    need to be added (the edge must be visible). The old hull edges under the new triangles are
+    queued, and once all the points are in, the queue is made to satisfy the Delaunay criterion by
+    flipping: each round tests all of its edges with one call to the vectorized incircle predicate,
+    and only the edges around a flip are tested again. A point that falls inside the current hull
+    (which the distance ordering does not rule out) is located by walking the triangulation, after
+    emptying the queue, and its triangle is split. Integer coordinates (as from
+    cell_reader.py --integers) keep every incircle test exact.
+
+    To find a visible edge without scanning the whole hull, hull vertices are indexed by their
+    angle around the center of the first triangle, which is always inside the hull. The counters
+    flipCount, flipTestCount and visibilityTestCount record the work done, so it can be checked
+    that the work per point stays bounded as the number of points grows. visibilityTestCount
+    includes the tests of which side of the center's rays a point is on.
+
+    Everything is held in flat arrays:
+    - points: (n, 2) float64, in internal (sorted) order.
+    - triangles: (m, 3) int32, counter-clockwise vertex indices.
+    - halfedges: (3m,) int32; halfedges[e] is the twin of half-edge e, or -1 on the hull.
+      Half-edge e belongs to triangle e // 3 and runs from
+      triangles.flat[e] to triangles.flat[next(e)].
 
     Start with these points:
       3   5
@@ -64,8 +87,8 @@ class Delaunay2d:
 
     >>> points = [[0,0], [1,2], [2,1], [1,3], [3,1], [3,3]]
     >>> delaunay = Delaunay2d(points)
-    >>> [list(point) for point in delaunay.points]
-    [[1, 2], [2, 1], [1, 3], [3, 1], [3, 3], [0, 0]]
+    >>> delaunay.points.tolist()
+    [[1.0, 2.0], [2.0, 1.0], [1.0, 3.0], [3.0, 1.0], [3.0, 3.0], [0.0, 0.0]]
 
     Points have been reordered:
       2   4
@@ -73,15 +96,33 @@ class Delaunay2d:
         1 3
     5
 
-    >>> delaunay.triangles
-    [[0, 1, 4], [0, 4, 2], [1, 4, 3], [0, 5, 1], [1, 5, 3], [0, 2, 5]]
+    >>> delaunay.triangles.tolist()
+    [[0, 4, 2], [0, 1, 4], [1, 3, 4], [1, 0, 5], [3, 1, 5], [0, 2, 5]]
 
     Internal order!
 
     >>> delaunay.getTriangles()
-    [[1, 2, 5], [1, 5, 3], [2, 5, 4], [1, 0, 2], [2, 0, 4], [1, 3, 0]]
+    [[0, 2, 1], [0, 1, 3], [0, 4, 2], [1, 2, 5], [1, 5, 3], [2, 4, 5]]
 
     Original order!
+
+    Duplicate points are only triangulated once, and collinear points are not lost:
+
+    >>> Delaunay2d([[0,0], [2,0], [1,0], [1,0], [1,1]]).getTriangles()
+    [[0, 2, 4], [1, 4, 2]]
+
+    Work per point does not grow with the number of points, even when many of them are inside
+    the hull as it grows, or are duplicates, as on a small integer grid:
+
+    >>> for n in [1000, 10000]:
+    ...     for points in [numpy.random.RandomState(0).rand(n, 2),
+    ...                    numpy.random.RandomState(0).randint(0, 100, size=(n, 2))]:
+    ...         delaunay = Delaunay2d(points)
+    ...         print(n, delaunay.visibilityTestCount < 10 * n, delaunay.flipTestCount < 20 * n)
+    1000 True True
+    1000 True True
+    10000 True True
+    10000 True True
     '''
 
     EPS = 1.23456789e-14
@@ -89,82 +130,138 @@ class Delaunay2d:
     def __init__(self, pairs):
 
         # data structures
-        self.points = [numpy.array(pair) for pair in pairs]
-        self.triangles = []  # cells
-        self.edge2Triangles = {}  # edge to triangle(s) map
-        self.boundaryEdges = set()
-        self.appliedBoundaryEdges = None
-        self.holes = None
+        self.points = numpy.array(pairs, dtype=numpy.float64).reshape(-1, 2)
+        n = len(self.points)
+        self._triangles = array('i')  # 3 vertex indices per triangle
+        self._halfedges = array('i')  # twin half-edge, or -1 on the hull
+        # Hull as a doubly linked list over vertex indices (counter-clockwise),
+        # and for each hull vertex, the half-edge which leaves it along the hull.
+        self.hullNext = array('i', [-1]) * n
+        self.hullPrev = array('i', [-1]) * n
+        self.hullTri = array('i', [-1]) * n
+        self.hullStart = -1
+        self.hullHash = array('i', [-1]) * max(int(numpy.ceil(numpy.sqrt(n))), 1)
+        self.hashCenter = (0.0, 0.0)
+
+        # counters
+        self.flipCount = 0
+        self.flipTestCount = 0
+        self.visibilityTestCount = 0
+        # edges to check against the Delaunay criterion, in one batch
+        self.pending = array('i')
 
         # compute center of gravity
-        cg = numpy.zeros((2,), numpy.float64)
-        for pt in self.points:
-            cg += pt
-        cg /= len(self.points)
+        cg = self.points.mean(axis=0) if n else numpy.zeros((2,), numpy.float64)
 
         # sort
-        def distanceSquare(pt):
-            d = pt - cg
-            return numpy.dot(d, d)
-        dSqFromCenter = numpy.array([distanceSquare(pt) for pt in self.points])
-        self.order = list(dSqFromCenter.argsort())
-        self.points = [self.points[i] for i in self.order]
-
-        # create first triangle, make sure we're getting a non-zero area otherwise
-        # drop the points
-        area = 0.0
-        index = 0
-        stop = False
-        while not stop and index + 2 < len(self.points):
-            area = self.getArea(index, index + 1, index + 2)
-            if abs(area) < self.EPS:
-                del self.points[index]
-            else:
-                stop = True
-        if index <= len(self.points) - 3:
-            tri = [index, index + 1, index + 2]
-            self.makeCounterClockwise(tri)
-            self.triangles.append(tri)
-
-            # boundary edges
-            e01 = (tri[0], tri[1])
-            self.boundaryEdges.add(e01)
-            e12 = (tri[1], tri[2])
-            self.boundaryEdges.add(e12)
-            e20 = (tri[2], tri[0])
-            self.boundaryEdges.add(e20)
-
-            e01 = self.makeKey(e01[0], e01[1])
-            self.edge2Triangles[e01] = [0, ]
-
-            e12 = self.makeKey(e12[0], e12[1])
-            self.edge2Triangles[e12] = [0, ]
-
-            e20 = self.makeKey(e20[0], e20[1])
-            self.edge2Triangles[e20] = [0, ]
-
-        else:
+        d = self.points - cg
+        dSqFromCenter = numpy.einsum('ij,ij->i', d, d)
+        self.order = dSqFromCenter.argsort(kind='mergesort')
+        self.points = numpy.ascontiguousarray(self.points[self.order])
+        # With integer coordinates, predicates work on ints and are exact.
+        self.exact = bool(
+            numpy.all(self.points == numpy.round(self.points))
+            and numpy.all(numpy.abs(self.points) < 2 ** 53)
+        )
+        self.coords = self.points.astype(numpy.int64) if self.exact else self.points
+        self._x = self.coords[:, 0].tolist()
+        self._y = self.coords[:, 1].tolist()
+
+        # create first triangle, make sure we're getting a non-zero area
+        seed = self.findSeed()
+        if seed is None:
             # all the points fall on a line
             return
-
-        # add additional points
-        for i in range(3, len(self.points)):
-            self.addPoint(i)
-
-        # remove all triangles inside holes
-        # TO DO
+        i0, i1, i2 = seed
+        tri = [i0, i1, i2]
+        self.makeCounterClockwise(tri)
+        t = self.addTriangle(tri[0], tri[1], tri[2], -1, -1, -1)
+        for k in range(3):
+            self.hullNext[tri[k]] = tri[(k + 1) % 3]
+            self.hullPrev[tri[k]] = tri[(k + 2) % 3]
+            self.hullTri[tri[k]] = t + k
+        self.hullStart = tri[0]
+        self.hashCenter = (
+            (self._x[i0] + self._x[i1] + self._x[i2]) / 3,
+            (self._y[i0] + self._y[i1] + self._y[i2]) / 3
+        )
+        for i in tri:
+            self.hullHash[self.hashKey(i)] = i
+
+        # add additional points: Of each set of duplicates, only the first, which sorting kept
+        # first, since they are at the same distance.
+        _, first = numpy.unique(self.points, axis=0, return_index=True)
+        duplicate = numpy.ones(n, dtype=bool)
+        duplicate[first] = False
+        duplicate = duplicate.tolist()
+        for i in range(n):
+            if i not in seed and not duplicate[i]:
+                self.addPoint(i)
+        self.flushFlips()
+
+    @property
+    def triangles(self):
+        return numpy.frombuffer(self._triangles, dtype=numpy.int32).reshape(-1, 3)
+
+    @property
+    def halfedges(self):
+        return numpy.frombuffer(self._halfedges, dtype=numpy.int32)
+
+    def findSeed(self):
+        """
+        @return the first three points, in internal order, which span a non-zero area, or None
+        """
+        x, y = self._x, self._y
+        n = len(x)
+        i0 = 0
+        i1 = next((i for i in range(1, n) if x[i] != x[i0] or y[i] != y[i0]), None)
+        if i1 is None:
+            return None
+        for i2 in range(i1 + 1, n):
+            if abs(self.getArea(i0, i1, i2)) >= self.EPS:
+                return (i0, i1, i2)
+        return None
 
     def getTriangles(self):
         """
-        @return triangles
+        @return triangles, in original order: Each is counter-clockwise, starting from its lowest
+        index, and the list is sorted by vertices, so the result does not depend on the order of
+        insertion.
+        """
+        return self.canonical(self.order[self.triangles])
+
+    @staticmethod
+    def canonical(triangles):
+        """
+        @param triangles (m, 3) array of counter-clockwise triangles
+        @return the same triangles as lists, each starting from its lowest index, sorted
         """
-        return [[self.order[point] for point in tri] for tri in self.triangles]
+        if not len(triangles):
+            return []
+        rotation = triangles.argmin(axis=1)[:, numpy.newaxis]
+        rotated = numpy.take_along_axis(triangles, (rotation + numpy.arange(3)) % 3, axis=1)
+        rotated = rotated[numpy.lexsort(numpy.sort(rotated, axis=1).T[::-1])]
+        return rotated.tolist()
 
     def getEdges(self):
         """
-        @return egdes
+        @return egdes, as sorted pairs of internal indices
         """
-        return self.edge2Triangles.keys()
+        halfedges = self.halfedges
+        triangles = self.triangles.ravel()
+        e = numpy.arange(len(halfedges))
+        keep = halfedges < e  # each interior edge once, and every hull edge
+        start = triangles[e[keep]]
+        end = triangles[self.next(e[keep])]
+        return list(zip(numpy.minimum(start, end).tolist(), numpy.maximum(start, end).tolist()))
+
+    @staticmethod
+    def next(e):
+        return e - e % 3 + (e + 1) % 3
+
+    @staticmethod
+    def prev(e):
+        return e - e % 3 + (e + 2) % 3
 
     def getArea(self, ip0, ip1, ip2):
         """
@@ -173,21 +270,18 @@ class Delaunay2d:
         @param ip1 index of second vertex
         @param ip2 index of third vertex
         """
-        d1 = self.points[ip1] - self.points[ip0]
-        d2 = self.points[ip2] - self.points[ip0]
-        return (d1[0]*d2[1] - d1[1]*d2[0])
+        x, y = self._x, self._y
+        return (x[ip1] - x[ip0]) * (y[ip2] - y[ip0]) - (y[ip1] - y[ip0]) * (x[ip2] - x[ip0])
 
     def isEdgeVisible(self, ip, edge):
         """
-        Return true iff the point lies to its right when the edge points down
+        Return true iff the point lies strictly to the right of the (counter-clockwise) hull edge
         @param ip point index
         @param edge (2 point indices with orientation)
         @return True if visible
         """
-        area = self.getArea(ip, edge[0], edge[1])
-        if area < self.EPS:
-            return True
-        return False
+        self.visibilityTestCount += 1
+        return self.getArea(ip, edge[0], edge[1]) < -self.EPS
 
     def makeCounterClockwise(self, ips):
         """
@@ -199,179 +293,348 @@ class Delaunay2d:
             # swap
             ips[1], ips[2] = ip2, ip1
 
-    def flipOneEdge(self, edge):
+    def addTriangle(self, i0, i1, i2, a, b, c):
         """
-        Flip one edge then update the data structures
-        @return set of edges to interate over at next iteration
+        Append a triangle and link its three half-edges to their twins
+        @return index of its first half-edge
         """
-
-        # start with empty set
-        res = set()
-
-        # assume edge is sorted
-        tris = self.edge2Triangles.get(edge, [])
-        if len(tris) < 2:
-                # nothing to do, just return
-            return res
-
-        iTri1, iTri2 = tris
-        tri1 = self.triangles[iTri1]
-        tri2 = self.triangles[iTri2]
-
-        # find the opposite vertices, not part of the edge
-        iOpposite1 = -1
-        iOpposite2 = -1
-        for i in range(3):
-            if not tri1[i] in edge:
-                iOpposite1 = tri1[i]
-            if not tri2[i] in edge:
-                iOpposite2 = tri2[i]
-
-        # compute the 2 angles at the opposite vertices
-        da1 = self.points[edge[0]] - self.points[iOpposite1]
-        db1 = self.points[edge[1]] - self.points[iOpposite1]
-        da2 = self.points[edge[0]] - self.points[iOpposite2]
-        db2 = self.points[edge[1]] - self.points[iOpposite2]
-        crossProd1 = self.getArea(iOpposite1, edge[0], edge[1])
-        crossProd2 = self.getArea(iOpposite2, edge[1], edge[0])
-        dotProd1 = numpy.dot(da1, db1)
-        dotProd2 = numpy.dot(da2, db2)
-        angle1 = abs(math.atan2(crossProd1, dotProd1))
-        angle2 = abs(math.atan2(crossProd2, dotProd2))
-
-        # Delaunay's test
-        if angle1 + angle2 > math.pi*(1.0 + self.EPS):
-
-            # flip the triangles
-            #                         / ^ \                                        / b \
-            # iOpposite1 + a|b + iOpposite2    =>     + - > +
-            #                         \     /                                        \ a /
-
-            newTri1 = [iOpposite1, edge[0], iOpposite2]  # triangle a
-            newTri2 = [iOpposite1, iOpposite2, edge[1]]  # triangle b
-
-            # update the triangle data structure
-            self.triangles[iTri1] = newTri1
-            self.triangles[iTri2] = newTri2
-
-            # now handle the topolgy of the edges
-
-            # remove this edge
-            del self.edge2Triangles[edge]
-
-            # add new edge
-            e = self.makeKey(iOpposite1, iOpposite2)
-            self.edge2Triangles[e] = [iTri1, iTri2]
-
-            # modify two edge entries which now connect to
-            # a different triangle
-            e = self.makeKey(iOpposite1, edge[1])
-            v = self.edge2Triangles[e]
-            for i in range(len(v)):
-                if v[i] == iTri1:
-                    v[i] = iTri2
-            res.add(e)
-
-            e = self.makeKey(iOpposite2, edge[0])
-            v = self.edge2Triangles[e]
-            for i in range(len(v)):
-                if v[i] == iTri2:
-                    v[i] = iTri1
-            res.add(e)
-
-            # these two edges might need to be flipped at the
-            # next iteration
-            res.add(self.makeKey(iOpposite1, edge[0]))
-            res.add(self.makeKey(iOpposite2, edge[1]))
-
-        return res
-
-    def flipEdges(self):
+        t = len(self._triangles)
+        self._triangles.extend((i0, i1, i2))
+        self._halfedges.extend((a, b, c))
+        self.link(t, a)
+        self.link(t + 1, b)
+        self.link(t + 2, c)
+        return t
+
+    def link(self, a, b):
+        self._halfedges[a] = b
+        if b != -1:
+            self._halfedges[b] = a
+
+    def getQuads(self, edges):
         """
-        Flip edges to statisfy Delaunay's criterion
+        @param edges array of interior half-edges
+        @return (pr, pl, p0, p1) arrays: the ends of each edge, and the vertices opposite it
+        in its own triangle and in its twin's
         """
-
-        # start with all the edges
-        edgeSet = set(self.edge2Triangles.keys())
-
-        continueFlipping = True
-
-        while continueFlipping:
-
-            #
-            # iterate until there are no more edges to flip
-            #
-
-            # collect the edges to flip
-            newEdgeSet = set()
-            for edge in edgeSet:
-                # union
-                newEdgeSet |= self.flipOneEdge(edge)
-
-            edgeSet = copy.copy(newEdgeSet)
-            continueFlipping = (len(edgeSet) > 0)
+        triangles = numpy.frombuffer(self._triangles, dtype=numpy.int32)
+        halfedges = numpy.frombuffer(self._halfedges, dtype=numpy.int32)
+        twins = halfedges[edges]
+        return (
+            triangles[edges],
+            triangles[self.next(edges)],
+            triangles[self.prev(edges)],
+            triangles[self.prev(twins)]
+        )
+
+    def flipOneEdge(self, a):
+        """
+        Flip one edge, then update the data structures
+        @param a half-edge
+        @return half-edges to check next
+        """
+        halfedges = self._halfedges
+        triangles = self._triangles
+        b = halfedges[a]
+
+        #           pl                    pl
+        #          /|\                   / \
+        #      al / | \ bl           al /  a\ bl
+        #        /  |  \               /     \
+        #     p0  a | b  p1   =>    p0 ------- p1
+        #        \  |  /               \  b  /
+        #      ar \ | / br           ar \   / br
+        #          \|/                   \ /
+        #           pr                    pr
+        a0 = a - a % 3
+        b0 = b - b % 3
+        al = a0 + (a + 1) % 3
+        ar = a0 + (a + 2) % 3
+        bl = b0 + (b + 2) % 3
+        br = b0 + (b + 1) % 3
+        p0 = triangles[ar]
+        p1 = triangles[bl]
+
+        self.flipCount += 1
+        triangles[a] = p1
+        triangles[b] = p0
+
+        hbl = halfedges[bl]
+        har = halfedges[ar]
+        # The two outer edges which move to another slot might be on the hull.
+        if hbl == -1:
+            self.hullTri[p1] = a
+        if har == -1:
+            self.hullTri[p0] = b
+        self.link(a, hbl)
+        self.link(b, har)
+        self.link(ar, bl)
+
+        # the four outer edges of the quad might need to be flipped at the next iteration
+        return (a, al, b, br)
+
+    def flipEdges(self, edges):
+        """
+        Flip edges to statisfy Delaunay's criterion, starting from the given half-edges
+        and following only the edges which each flip puts at risk.
+        Each round tests all of its candidate edges with one incircle call.
+        """
+        candidates = numpy.array(edges, dtype=numpy.int64)
+        while len(candidates):
+            twins = self.halfedges[candidates]
+            # hull edges can't be flipped, and each edge is tested once, from either side
+            candidates = numpy.unique(numpy.minimum(candidates, twins)[twins != -1])
+            self.flipTestCount += len(candidates)
+            pr, pl, p0, p1 = self.getQuads(candidates)
+            coords = self.coords
+            illegal = candidates[incircle(coords[pr], coords[pl], coords[p0], coords[p1]) > 0]
+
+            # Flips in one round must not share a triangle: the others wait for the next round.
+            nextCandidates = []
+            flipped = set()
+            for (a, ta, tb) in zip(illegal.tolist(), (illegal // 3).tolist(),
+                                   (self.halfedges[illegal] // 3).tolist()):
+                if ta in flipped or tb in flipped:
+                    nextCandidates.append(a)
+                else:
+                    flipped.add(ta)
+                    flipped.add(tb)
+                    nextCandidates.extend(self.flipOneEdge(a))
+            candidates = numpy.array(nextCandidates, dtype=numpy.int64)
+
+    def flushFlips(self):
+        """
+        Flip the pending edges, and what they put at risk
+        """
+        if self.pending:
+            self.flipEdges(self.pending)
+            self.pending = array('i')
 
     def addPoint(self, ip):
         """
         Add point
         @param ip point index
         """
+        start = self.findVisibleEdge(ip)
+        if start is None:
+            self.addInteriorPoint(ip)
+            return
+
+        hullNext = self.hullNext
+        hullPrev = self.hullPrev
+        hullTri = self.hullTri
+
+        # the first visible edge e -> n becomes the base of a new triangle
+        e = start
+        n = hullNext[e]
+        t = self.addTriangle(n, e, ip, hullTri[e], -1, -1)
+        hullTri[e] = t + 1
+        hullTri[ip] = t + 2
+        # the old hull edges are the only ones which might need to be flipped
+        self.pending.append(t)
+
+        # walk forward through the hull, adding more triangles
+        while True:
+            q = hullNext[n]
+            if not self.isEdgeVisible(ip, (n, q)):
+                break
+            t = self.addTriangle(q, n, ip, hullTri[n], hullTri[ip], -1)
+            hullTri[ip] = t + 2
+            hullNext[n] = -1  # mark as removed
+            self.pending.append(t)
+            n = q
+
+        # walk backward from the other side, adding more triangles
+        while True:
+            w = hullPrev[e]
+            if not self.isEdgeVisible(ip, (w, e)):
+                break
+            t = self.addTriangle(e, w, ip, hullTri[w], -1, hullTri[e])
+            hullTri[w] = t + 1
+            hullNext[e] = -1  # mark as removed
+            self.pending.append(t)
+            e = w
+
+        # update the hull
+        hullPrev[ip] = e
+        hullNext[e] = ip
+        hullPrev[n] = ip
+        hullNext[ip] = n
+        self.hullStart = e
+        self.hullHash[self.hashKey(ip)] = ip
+        self.hullHash[self.hashKey(e)] = e
+
+    def hashKey(self, ip):
+        """
+        @return bucket of the point's angle around the hash center
+        """
+        dx = self._x[ip] - self.hashCenter[0]
+        dy = self._y[ip] - self.hashCenter[1]
+        # Monotonic in the angle, but cheaper than atan2:
+        p = dx / ((abs(dx) + abs(dy)) or 1)
+        angle = (3 - p if dy > 0 else 1 + p) / 4
+        size = len(self.hullHash)
+        return int(angle * size) % size
+
+    def findVisibleEdge(self, ip):
+        """
+        Look up a hull vertex at a slightly smaller angle than the point, and walk forward along
+        the hull to the edge whose wedge around the hash center holds the point. The hull is
+        convex around the center, so the point is outside only if that edge, or one next to it
+        where the angle is close, is visible: A point inside the hull, or a duplicate, is found
+        with a few tests instead of a walk around the whole hull.
+        @return vertex at the start of a hull edge visible from the point, or None if the point
+        is not outside the hull
+        """
+        hullHash = self.hullHash
+        hullNext = self.hullNext
+        size = len(hullHash)
+        key = self.hashKey(ip)
+        start = self.hullStart
+        for j in range(1, size + 1):
+            candidate = hullHash[(key - j) % size]
+            # Skip buckets whose vertex has since left the hull.
+            if candidate != -1 and hullNext[candidate] != -1:
+                start = candidate
+                break
+
+        x, y = self._x, self._y
+        cx, cy = self.hashCenter
+        px, py = x[ip] - cx, y[ip] - cy
+
+        def side(v):
+            # positive if the point is counter-clockwise of the ray from the center through v
+            self.visibilityTestCount += 1
+            return (x[v] - cx) * py - (y[v] - cy) * px
+
+        e = start
+        s = side(e)
+        while True:
+            n = hullNext[e]
+            t = side(n)
+            if s >= 0 and t < 0:
+                break
+            e, s = n, t
+            if e == start:
+                # Only the center itself is in no wedge, unless rounding hides the wedge.
+                return None if px == py == 0 else self.scanVisibleEdge(ip, start)
+        for v in (e, self.hullPrev[e], n):
+            if self.isEdgeVisible(ip, (v, hullNext[v])):
+                return v
+        return None
+
+    def scanVisibleEdge(self, ip, start):
+        """
+        Walk the whole hull from start
+        @return vertex at the start of a hull edge visible from the point, or None
+        """
+        e = start
+        while not self.isEdgeVisible(ip, (e, self.hullNext[e])):
+            e = self.hullNext[e]
+            if e == start:
+                return None
+        return e
+
+    def addInteriorPoint(self, ip):
+        """
+        Add a point which lies inside the hull, or on its boundary, by splitting the triangle
+        (or the edge) it falls on. Points which duplicate a vertex are skipped.
+        """
+        # the walk can cycle in a triangulation which is not yet Delaunay
+        self.flushFlips()
+        located = self.locate(ip)
+        if located is None:
+            return
+        a, onEdge = located
+        triangles = self._triangles
+        halfedges = self._halfedges
+        hullTri = self.hullTri
+        t0 = a - a % 3
+        pa = triangles[a]
+        pb = triangles[self.next(a)]
+        pc = triangles[self.prev(a)]
+        ha = halfedges[a]
+        hb = halfedges[self.next(a)]
+        hc = halfedges[self.prev(a)]
+
+        if not onEdge:
+            # split (pa, pb, pc) into three triangles around the point
+            t1 = len(triangles)
+            t2 = t1 + 3
+            triangles[t0:t0 + 3] = array('i', (pa, pb, ip))
+            self.addTriangle(pb, pc, ip, hb, -1, t0 + 1)
+            self.addTriangle(pc, pa, ip, hc, t0 + 2, t1 + 1)
+            self.link(t0, ha)
+            for (h, e, p) in ((ha, t0, pa), (hb, t1, pb), (hc, t2, pc)):
+                if h == -1:
+                    hullTri[p] = e
+            self.flipEdges((t0, t1, t2))
+            return
 
-        # collection for later updates
-        boundaryEdgesToRemove = set()
-        boundaryEdgesToAdd = set()
-
-        for edge in self.boundaryEdges:
-
-            if self.isEdgeVisible(ip, edge):
-
-                # create new triangle
-                newTri = [edge[0], edge[1], ip]
-                newTri.sort()
-                self.makeCounterClockwise(newTri)
-                self.triangles.append(newTri)
-
-                # update the edge to triangle map
-                e = list(edge[:])
-                e.sort()
-                iTri = len(self.triangles) - 1
-                self.edge2Triangles[tuple(e)].append(iTri)
-
-                # add the two boundary edges
-                e1 = [ip, edge[0]]
-                e1.sort()
-                e1 = tuple(e1)
-                e2 = [edge[1], ip]
-                e2.sort()
-                e2 = tuple(e2)
-                v1 = self.edge2Triangles.get(e1, [])
-                v1.append(iTri)
-                v2 = self.edge2Triangles.get(e2, [])
-                v2.append(iTri)
-                self.edge2Triangles[e1] = v1
-                self.edge2Triangles[e2] = v2
-
-                # keep track of the boundary edges to update
-                boundaryEdgesToRemove.add(edge)
-                boundaryEdgesToAdd.add((edge[0], ip))
-                boundaryEdgesToAdd.add((ip, edge[1]))
-
-        # update the boundary edges
-        for bedge in boundaryEdgesToRemove:
-            self.boundaryEdges.remove(bedge)
-        for bedge in boundaryEdgesToAdd:
-            bEdgeSorted = list(bedge)
-            bEdgeSorted.sort()
-            bEdgeSorted = tuple(bEdgeSorted)
-            if len(self.edge2Triangles[bEdgeSorted]) == 1:
-                # only add boundary edge if it does not appear
-                # twice in different order
-                self.boundaryEdges.add(bedge)
-
-        # recursively flip edges
-        flipped = True
-        while flipped:
-            flipped = self.flipEdges()
+        # the point is on edge pa -> pb: split the triangle on each side in two
+        t1 = len(triangles)
+        triangles[t0:t0 + 3] = array('i', (pa, ip, pc))
+        self.addTriangle(ip, pb, pc, -1, hb, t0 + 1)
+        self.link(t0 + 2, hc)
+        if hc == -1:
+            hullTri[pc] = t0 + 2
+        if hb == -1:
+            hullTri[pb] = t1 + 1
+
+        if ha == -1:
+            # on the hull
+            self.hullNext[pa] = ip
+            self.hullPrev[ip] = pa
+            self.hullNext[ip] = pb
+            self.hullPrev[pb] = ip
+            hullTri[pa] = t0
+            hullTri[ip] = t1
+            self.link(t0, -1)
+            self.flipEdges((t0 + 2, t1 + 1))
+            return
+
+        u0 = ha - ha % 3
+        pd = triangles[self.prev(ha)]
+        hd = halfedges[self.prev(ha)]  # pd -> pb
+        he = halfedges[self.next(ha)]  # pa -> pd
+        u1 = len(triangles)
+        triangles[u0:u0 + 3] = array('i', (pb, ip, pd))
+        self.addTriangle(ip, pa, pd, t0, he, u0 + 1)
+        self.link(u0, t1)
+        self.link(u0 + 2, hd)
+        if hd == -1:
+            hullTri[pd] = u0 + 2
+        if he == -1:
+            hullTri[pa] = u1 + 1
+        self.flipEdges((t0 + 2, t1 + 1, u0 + 2, u1 + 1))
+
+    def locate(self, ip):
+        """
+        Walk from the most recent triangle towards the point
+        @return (half-edge, onEdge): the point is inside the half-edge's triangle,
+        or on the half-edge itself; None if the point duplicates a vertex
+        """
+        triangles = self._triangles
+        halfedges = self._halfedges
+        x, y = self._x, self._y
+        e = len(triangles) - 3
+        for _ in range(len(triangles)):
+            t0 = e - e % 3
+            onEdges = []
+            for a in (t0, t0 + 1, t0 + 2):
+                area = self.getArea(triangles[a], triangles[self.next(a)], ip)
+                if area < -self.EPS and halfedges[a] != -1:
+                    e = halfedges[a]
+                    break
+                if abs(area) <= self.EPS:
+                    onEdges.append(a)
+            else:
+                if any(x[triangles[a]] == x[ip] and y[triangles[a]] == y[ip] for a in (t0, t0 + 1, t0 + 2)):
+                    return None
+                if onEdges:
+                    return (onEdges[0], True)
+                return (t0, False)
+        return None
 
     def makeKey(self, i1, i2):
         """
@@ -384,45 +647,242 @@ class Delaunay2d:
     def show(self, width=500, height=500, showVertices=False, showCells=False, showContour=[]):
         import tkinter
 
-        xmin = min([p[0] for p in self.points])
-        ymin = min([p[1] for p in self.points])
-        xmax = max([p[0] for p in self.points])
-        ymax = max([p[1] for p in self.points])
+        xmin, ymin = self.points.min(axis=0)
+        xmax, ymax = self.points.max(axis=0)
         padding = 5
         w = width - 2*padding
         h = height - 2*padding
 
+        def toCanvas(pt):
+            return (padding + int(w*(pt[0] - xmin)/(xmax - xmin)),
+                    padding + int(h*(ymax - pt[1])/(ymax - ymin)))
+
         master = tkinter.Tk()
         c = tkinter.Canvas(master, width=width, height=height)
         c.pack()
-        for e in self.edge2Triangles:
-          i1, i2 = e
-          xp1 = padding + int(w*(self.points[i1][0] - xmin)/(xmax - xmin))
-          yp1 = padding + int(h*(ymax - self.points[i1][1])/(ymax - ymin))
-          xp2 = padding + int(w*(self.points[i2][0] - xmin)/(xmax - xmin))
-          yp2 = padding + int(h*(ymax - self.points[i2][1])/(ymax - ymin))
-          c.create_line(xp1, yp1, xp2, yp2)
+        for i1, i2 in self.getEdges():
+            c.create_line(*toCanvas(self.points[i1]), *toCanvas(self.points[i2]))
 
         if showVertices:
-          for i in range(len(self.points)):
-            xp = padding + int(w*(self.points[i][0] - xmin)/(xmax - xmin))
-            yp = padding + int(h*(ymax - self.points[i][1])/(ymax - ymin))
-            c.create_text(xp, yp, text=str(i))
+            for i, pt in enumerate(self.points):
+                c.create_text(*toCanvas(pt), text=str(i))
 
         if showCells:
-          for tId, tVals in self.triangles.items():
-            cg = reduce(operator.add, [self.points[i] for i in tVals])/float(len(tVals))
-            xp = padding + int(w*(cg[0] - xmin)/(xmax - xmin))
-            yp = padding + int(h*(ymax - cg[1])/(ymax - ymin))
-            c.create_text(xp, yp, text=str(tId))
-
-        if len(showContour) > 0:
-          for i in range(len(showContour) - 1):
-            xp1 = padding + int(w*(showContour[i][0] - xmin)/(xmax - xmin))
-            yp1 = padding + int(h*(ymax - showContour[i][1])/(ymax - ymin))
-            xp2 = padding + int(w*(showContour[i+1][0] - xmin)/(xmax - xmin))
-            yp2 = padding + int(h*(ymax - showContour[i+1][1])/(ymax - ymin))
-            c.create_line(xp1, yp1, xp2, yp2, fill='red')
+            for tId, tVals in enumerate(self.triangles):
+                c.create_text(*toCanvas(self.points[tVals].mean(axis=0)), text=str(tId))
 
+        for i in range(len(showContour) - 1):
+            c.create_line(*toCanvas(showContour[i]), *toCanvas(showContour[i+1]), fill='red')
 
         tkinter.mainloop()
+
+
+def triangulateTile(tile):
+    """
+    Triangulate the points of one tile, and keep the triangles which are certainly in the global
+    triangulation: those whose circumcircle lies inside the tile's region, where every point of
+    the whole set is known, and passes through no fourth point.
+    @param tile (ids, points, core, bounds): global ids and coordinates of the points in the
+    tile's region, which of them are in the tile itself, and (xmin, ymin, xmax, ymax) of the region
+    @return (m, 3) array of counter-clockwise triangles, as global ids
+    """
+    ids, points, core, (xmin, ymin, xmax, ymax) = tile
+    delaunay = Delaunay2d(points)
+    triangles = delaunay.triangles
+    if not len(triangles):
+        return numpy.zeros((0, 3), dtype=ids.dtype)
+
+    # A fourth point on the circle would be opposite one of the edges, so the Delaunay criterion
+    # must hold strictly across each of them. With float coordinates, a determinant within the
+    # rounding error may be a fourth point on the circle, which another tile may triangulate the
+    # other way: Those triangles are left to the seams.
+    coords = delaunay.coords
+    halfedges = delaunay.halfedges
+    e = numpy.flatnonzero(halfedges != -1)
+    a, b, c = triangles[e // 3].T
+    d = triangles.ravel()[delaunay.prev(halfedges[e])]
+    quads = (coords[a], coords[b], coords[c], coords[d])
+    strict = numpy.ones(len(halfedges), dtype=bool)
+    strict[e] = incircle(*quads) < -incircle_error(*quads)
+    strict = strict.reshape(-1, 3).all(axis=1)
+
+    p0, p1, p2 = (delaunay.points[triangles[:, k]] for k in range(3))
+    u = p1 - p0
+    v = p2 - p0
+    uu = (u * u).sum(axis=1)
+    vv = (v * v).sum(axis=1)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        cross = 2 * (u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0])
+        cx = (v[:, 1] * uu - u[:, 1] * vv) / cross
+        cy = (u[:, 0] * vv - v[:, 0] * uu) / cross
+        r = numpy.sqrt(cx * cx + cy * cy) * (1 + 1e-9)
+        cx += p0[:, 0]
+        cy += p0[:, 1]
+        inside = (cx - r > xmin) & (cx + r < xmax) & (cy - r > ymin) & (cy + r < ymax)
+
+    # Each tile reports the triangles touching its own points; the margins report the rest.
+    owned = core[delaunay.order[triangles]].any(axis=1)
+    return ids[delaunay.order[triangles[strict & inside & owned]]]
+
+
+class TiledDelaunay2d:
+    '''
+    Delaunay triangulation of a large point set, one tile at a time: The plane is cut into square
+    tiles, and each tile is triangulated together with the points in a margin around it, in a pool
+    of worker processes. Only triangles which no point outside the tile and its margin could
+    change are kept (see triangulateTile). They leave holes along the seams between tiles, and
+    around the hull: The points on the edges of the holes, and inside them, are triangulated
+    again, and the triangles which fill the holes are added. Each hole is bounded by edges which
+    are in every Delaunay triangulation of those points, so for points in general position the
+    result is the one Delaunay2d gives.
+
+    Where four or more points lie on one empty circle, or are within rounding error of one for
+    float coordinates, the triangles there are left to the seams, so that no two tiles choose
+    different triangles for them. The seams may still choose other ones than Delaunay2d does: The
+    result is then another Delaunay triangulation of the points, with the same number of
+    triangles, but not the same triangles.
+
+    Duplicate points are triangulated once, using the first of them, as in Delaunay2d.
+
+    >>> points = numpy.random.RandomState(0).rand(2000, 2)
+    >>> tiled = TiledDelaunay2d(points, tileSize=0.25, workers=2)
+    >>> tiled.getTriangles() == Delaunay2d(points).getTriangles()
+    True
+    >>> tiled.tileCount, tiled.seamPointCount < 200
+    (16, True)
+
+    On regular grids, many points lie on one circle:
+
+    >>> grid = numpy.mgrid[0:30, 0:30].reshape(2, -1).T
+    >>> TiledDelaunay2d(grid, tileSize=10).getTriangles() == Delaunay2d(grid).getTriangles()
+    True
+    >>> def overlaps(triangles):
+    ...     edges = numpy.sort(numpy.array(triangles)[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2), axis=1)
+    ...     return (numpy.unique(edges, axis=0, return_counts=True)[1] > 2).sum()
+    >>> for (points, tileSize) in [(grid * 0.1, 1), (grid * [1.0, 0.866], 13)]:
+    ...     triangles = TiledDelaunay2d(points, tileSize=tileSize).getTriangles()
+    ...     print(len(triangles), len(Delaunay2d(points).getTriangles()), overlaps(triangles))
+    1682 1682 0
+    1682 1682 0
+
+    Tiles with too few points to triangulate are left to the seams:
+
+    >>> TiledDelaunay2d([[0,0], [2,0], [1,0], [1,0], [1,1]], tileSize=1).getTriangles()
+    [[0, 2, 4], [1, 4, 2]]
+    '''
+
+    def __init__(self, pairs, tileSize, workers=1, margin=None):
+        """
+        @param tileSize width and height of the tiles
+        @param workers number of processes which triangulate tiles
+        @param margin width of the margin around each tile, at most tileSize; by default, five
+        times the mean distance between points
+        """
+        points = numpy.array(pairs, dtype=numpy.float64).reshape(-1, 2)
+
+        # the first of each set of duplicates
+        _, first = numpy.unique(points, axis=0, return_index=True)
+        self.ids = numpy.sort(first)
+        self.points = points[self.ids]
+        n = len(self.points)
+        if margin is None:
+            area = numpy.prod(numpy.ptp(self.points, axis=0)) if n else 0
+            margin = 5 * numpy.sqrt(area / max(n, 1))
+        margin = min(margin, tileSize)
+
+        tiles = self.getTiles(tileSize, margin)
+        self.tileCount = len(tiles)
+        if workers > 1 and len(tiles) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                chunksize = max(len(tiles) // (4 * workers), 1)
+                found = list(executor.map(triangulateTile, tiles, chunksize=chunksize))
+        else:
+            found = [triangulateTile(tile) for tile in tiles]
+        found = numpy.concatenate(found + [numpy.zeros((0, 3), dtype=numpy.int64)]).astype(numpy.int64)
+        # Triangles in more than one tile's margin are reported more than once.
+        rotation = found.argmin(axis=1)[:, numpy.newaxis]
+        found = numpy.take_along_axis(found, (rotation + numpy.arange(3)) % 3, axis=1)
+        if len(found):
+            found = numpy.unique(found, axis=0)
+
+        # Half-edges of the found triangles, and which of them border a hole
+        u = found.ravel()
+        v = found[:, [1, 2, 0]].ravel()
+        foundEdges = u * n + v
+        border = ~numpy.isin(v * n + u, foundEdges)
+        uncovered = numpy.ones(n, dtype=bool)
+        uncovered[u] = False
+        seam = numpy.union1d(numpy.concatenate((u[border], v[border])), numpy.flatnonzero(uncovered))
+        self.seamPointCount = len(seam)
+
+        self.triangles = numpy.concatenate((found, self.fillHoles(seam, foundEdges, uncovered)))
+
+    def getTiles(self, tileSize, margin):
+        """
+        @return for each tile with points, the argument for triangulateTile
+        """
+        points = self.points
+        if not len(points):
+            return []
+        low = points.min(axis=0)
+        cells = ((points - low) // tileSize).astype(numpy.int64)
+        shape = cells.max(axis=0) + 1
+        cellIds = cells[:, 0] * shape[1] + cells[:, 1]
+        order = numpy.argsort(cellIds, kind='mergesort')
+        starts = numpy.searchsorted(cellIds[order], numpy.arange(shape[0] * shape[1] + 1))
+
+        tiles = []
+        for (i, j) in numpy.unique(cells, axis=0).tolist():
+            # A margin no wider than a tile only reaches into the neighboring tiles.
+            ids = numpy.concatenate([
+                order[starts[k * shape[1] + l]:starts[k * shape[1] + l + 1]]
+                for k in range(max(i - 1, 0), min(i + 2, shape[0]))
+                for l in range(max(j - 1, 0), min(j + 2, shape[1]))
+            ])
+            # There are no points beyond the outer tiles, so their regions are unbounded.
+            xmin = low[0] + i * tileSize - margin if i > 0 else -numpy.inf
+            ymin = low[1] + j * tileSize - margin if j > 0 else -numpy.inf
+            xmax = low[0] + (i + 1) * tileSize + margin if i < shape[0] - 1 else numpy.inf
+            ymax = low[1] + (j + 1) * tileSize + margin if j < shape[1] - 1 else numpy.inf
+            x, y = points[ids].T
+            ids = numpy.sort(ids[(x >= xmin) & (x < xmax) & (y >= ymin) & (y < ymax)])
+            core = (cells[ids, 0] == i) & (cells[ids, 1] == j)
+            tiles.append((ids, points[ids], core, (xmin, ymin, xmax, ymax)))
+        return tiles
+
+    def fillHoles(self, seam, foundEdges, uncovered):
+        """
+        Triangulate the seam points, and keep the triangles on the hole side of the found ones
+        @return (m, 3) array of counter-clockwise triangles
+        """
+        n = len(self.points)
+        delaunay = Delaunay2d(self.points[seam])
+        triangles = seam[delaunay.order[delaunay.triangles]].astype(numpy.int64)
+        if not len(triangles):
+            return triangles
+        halfedges = delaunay.halfedges.tolist()
+        u = triangles.ravel()
+        v = triangles[:, [1, 2, 0]].ravel()
+        # Across these edges are found triangles: The holes end there.
+        walls = numpy.isin(v * n + u, foundEdges)
+        wallList = walls.tolist()
+        found = numpy.isin(u * n + v, foundEdges).reshape(-1, 3).any(axis=1)
+
+        inHole = numpy.zeros(len(triangles), dtype=bool)
+        seeds = walls.reshape(-1, 3).any(axis=1) | uncovered[triangles].any(axis=1)
+        stack = numpy.flatnonzero(seeds & ~found).tolist()
+        while stack:
+            t = stack.pop()
+            if inHole[t]:
+                continue
+            inHole[t] = True
+            for e in (3 * t, 3 * t + 1, 3 * t + 2):
+                if not wallList[e] and halfedges[e] != -1:
+                    stack.append(halfedges[e] // 3)
+        return triangles[inHole]
+
+    def getTriangles(self):
+        """
+        @return triangles, in original order, as from Delaunay2d.getTriangles
+        """
+        return Delaunay2d.canonical(self.ids[self.triangles])
@@ -2,10 +2,16 @@
 
 import json
 import argparse
-from collections import defaultdict
+import sys
+from collections import Counter, defaultdict
 
+from factor_encoder import get_factor
+from json_writer import write_json
+from polygons import PolygonStore, write_levels_zarr
+from precision import round_values, summary
 
-def cells_json(data):
+
+def cells_json(data, report=None):
     '''
     >>> data = {
     ...     "cell_1": {
@@ -25,13 +31,29 @@ def cells_json(data):
     dict_keys(['cell_1'])
     >>> cells['cell_1'].keys()
     dict_keys(['mappings', 'genes', 'xy', 'factors', 'poly'])
-
+    >>> data['cell_1']['mappings']['tsne'] = [-11.077612345, 6.0311]
+    >>> cells_json(data)['cell_1']['mappings']['t-SNE']
+    [-11.0776, 6.0311]
     '''
+    cell_ids = list(data.keys())
+    tsne = round_values(
+        [data[cell_id]['mappings']['tsne'] for cell_id in cell_ids],
+        'embedding', report
+    ).tolist()
+    umap = round_values(
+        [data[cell_id]['mappings']['umap'] for cell_id in cell_ids],
+        'embedding', report
+    ).tolist()
+    locations = round_values(
+        [data[cell_id]['locations'] for cell_id in cell_ids],
+        'position', report
+    ).tolist()
+
     cell_dict = {}
-    for cell_id in data.keys():
+    for (i, cell_id) in enumerate(cell_ids):
         mappings_dict = {
-            't-SNE': data[cell_id]['mappings']['tsne'],
-            'UMAP': data[cell_id]['mappings']['umap']
+            't-SNE': tsne[i],
+            'UMAP': umap[i]
         }
         factors = data[cell_id]['factors']
         factors_dict = {
@@ -41,7 +63,7 @@ def cells_json(data):
         cell_dict[cell_id] = {
             'mappings': mappings_dict,
             'genes': {},
-            'xy': data[cell_id]['locations'],
+            'xy': locations[i],
             'factors': factors_dict,
             'poly': []
         }
@@ -138,37 +160,14 @@ def factors_json(data):
     dict_keys(['map', 'cells'])
 
     '''
-    def get_factor(cell, factor_name):
-        return cell['factors'][factor_name][0]
-    pleiden_clusters = list({
-        get_factor(cell, 'pleiden_clus') for cell in data.values()
-    })
-    kmeans_clusters = list({
-        get_factor(cell, 'kmeans') for cell in data.values()
-    })
-
-    pleiden_cells = {}
-    kmeans_cells = {}
-
-    for cell_id in data:
-        factors = data[cell_id]['factors']
-        pleiden_cells[cell_id] = pleiden_clusters.index(
-            factors['pleiden_clus'][0]
-        )
-        kmeans_cells[cell_id] = kmeans_clusters.index(
-            factors['kmeans'][0]
-        )
-
-    factors_dict = {
-        'pleiden_clus': {
-            'map': ['Cluster {}'.format(c) for c in pleiden_clusters],
-            'cells': pleiden_cells
-        },
-        'kmeans': {
-            'map': ['Cluster {}'.format(c) for c in kmeans_clusters],
-            'cells': kmeans_cells
-        }
-    }
+    cell_ids = list(data.keys())
+    factors_dict = {}
+    for factor_name in ['pleiden_clus', 'kmeans']:
+        factor = get_factor(cell_ids, [
+            data[cell_id]['factors'][factor_name][0] for cell_id in cell_ids
+        ], sort=True)
+        factor['map'] = ['Cluster {}'.format(c) for c in factor['map']]
+        factors_dict[factor_name] = factor
 
     return factors_dict
 
@@ -189,14 +188,28 @@ if __name__ == '__main__':
     parser.add_argument(
         '--factors_file', type=argparse.FileType('x'),
         help='Write the cell factors to this file.')
+    parser.add_argument(
+        '--polygons_zarr',
+        help='Write the cell locations to this zarr store, as the '
+             'centroid level of detail: There are no outlines.')
     args = parser.parse_args()
 
     with open(args.json_file) as json_file:
         data = json.load(json_file)
 
+    report = Counter()
     if args.cells_file:
-        json.dump(cells_json(data), args.cells_file, indent=1)
+        write_json(cells_json(data, report), args.cells_file, indent=1)
     if args.cell_sets_file:
-        json.dump(cell_sets_json(data), args.cell_sets_file, indent=1)
+        write_json(cell_sets_json(data), args.cell_sets_file, indent=1)
     if args.factors_file:
-        json.dump(factors_json(data), args.factors_file, indent=1)
+        write_json(factors_json(data), args.factors_file, indent=1)
+    if args.polygons_zarr:
+        locations = PolygonStore.from_dict({
+            cell_id: [cell['locations']] for (cell_id, cell) in data.items()
+        })
+        write_levels_zarr(
+            args.polygons_zarr, locations, levels=['centroid']
+        )
+
+    print(summary(report), file=sys.stderr)
@@ -0,0 +1,97 @@
+import numpy as np
+import pandas
+
+
+def encode(values, sort=False):
+    '''
+    Returns the code of each value, as an array of indices into the
+    categories, and the categories, in order of first appearance
+    or sorted. Values are hashed, rather than searched for in a list.
+    A missing value, None or NaN, is a category of its own: In order
+    of first appearance, or last if sorted.
+
+    >>> codes, categories = encode(['dog', 'cat', 'dog'])
+    >>> codes.tolist()
+    [0, 1, 0]
+    >>> categories
+    ['dog', 'cat']
+    >>> codes, categories = encode(['dog', 'cat', 'dog'], sort=True)
+    >>> codes.tolist()
+    [1, 0, 1]
+    >>> categories
+    ['cat', 'dog']
+    >>> codes, categories = encode(['dog', None, 'cat', None])
+    >>> codes.tolist()
+    [0, 1, 2, 1]
+    >>> categories
+    ['dog', None, 'cat']
+    >>> codes, categories = encode([float('nan'), 'dog', 'cat'], sort=True)
+    >>> codes.tolist()
+    [2, 1, 0]
+    >>> categories
+    ['cat', 'dog', nan]
+    '''
+    series = pandas.Series(values, dtype=object)
+    codes, categories = pandas.factorize(series, sort=sort)
+    categories = categories.tolist()
+    # factorize codes missing values as -1, rather than as a category.
+    missing = codes < 0
+    if missing.any():
+        first = int(np.argmax(missing))
+        if sort:
+            position = len(categories)
+        else:
+            # Codes are in order of first appearance, so the values before
+            # the first missing one have the codes below its position.
+            position = int(codes[:first].max()) + 1 if first else 0
+        codes = np.where(codes >= position, codes + 1, codes)
+        codes[missing] = position
+        categories.insert(position, series.iloc[first])
+    return codes, categories
+
+
+def extend_factor(factor, cell_ids, values):
+    '''
+    Adds the cells to the factor, coded by their values, and adds new
+    values to the end of its map. Each value is looked up once per call,
+    rather than once per cell.
+
+    >>> factor = {'map': [], 'cells': {}}
+    >>> _ = extend_factor(factor, ['a', 'b'], ['dog', 'cat'])
+    >>> factor = extend_factor(factor, ['c', 'd'], ['fish', 'dog'])
+    >>> factor['map']
+    ['dog', 'cat', 'fish']
+    >>> factor['cells']
+    {'a': 0, 'b': 1, 'c': 2, 'd': 0}
+    >>> factor = extend_factor(factor, ['e', 'f'], [None, 'cat'])
+    >>> factor['map']
+    ['dog', 'cat', 'fish', None]
+    >>> factor['cells']['e'], factor['cells']['f']
+    (3, 1)
+    '''
+    codes, categories = encode(values)
+    index = {value: code for (code, value) in enumerate(factor['map'])}
+    recoded = []
+    for value in categories:
+        if value not in index:
+            index[value] = len(factor['map'])
+            factor['map'].append(value)
+        recoded.append(index[value])
+    codes = np.array(recoded, dtype=np.int64)[codes]
+    factor['cells'].update(zip(cell_ids, codes.tolist()))
+    return factor
+
+
+def get_factor(cell_ids, values, sort=False):
+    '''
+    Returns the map of distinct values, in order of first appearance
+    or sorted, and the index of each cell's value in it.
+
+    >>> get_factor(['a', 'b', 'c'], [8, 3, 8], sort=True)
+    {'map': [3, 8], 'cells': {'a': 1, 'b': 0, 'c': 1}}
+    '''
+    codes, categories = encode(values, sort=sort)
+    return {
+        'map': categories,
+        'cells': dict(zip(cell_ids, codes.tolist()))
+    }
@@ -0,0 +1,167 @@
+import json
+
+import numpy as np
+
+# Characters to collect before each write to the file.
+BUFFER_SIZE = 1 << 20
+
+
+def _default(value):
+    '''
+    Encodes the numpy values which json does not know.
+
+    >>> json.dumps([np.int64(1), np.float32(0.5), np.arange(2)],
+    ...            default=_default)
+    '[1, 0.5, [0, 1]]'
+    '''
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(
+        'Object of type {} is not JSON serializable'.format(
+            type(value).__name__)
+    )
+
+
+def _key(key):
+    '''
+    Object keys are strings: Others are converted as json.dumps would.
+
+    >>> [_key(k) for k in ['a', 1, np.int64(2), 0.5, True, None]]
+    ['a', '1', '2', '0.5', 'true', 'null']
+    '''
+    if isinstance(key, str):
+        return key
+    if isinstance(key, np.generic):
+        key = key.item()
+    return next(iter(json.loads(json.dumps({key: 0}))))
+
+
+class _Sink:
+    '''
+    Collects text, and writes it to the file in large pieces.
+    '''
+    def __init__(self, json_file, buffer_size=BUFFER_SIZE):
+        self.json_file = json_file
+        self.buffer_size = buffer_size
+        self.pieces = []
+        self.size = 0
+
+    def write(self, text):
+        self.pieces.append(text)
+        self.size += len(text)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.json_file.write(''.join(self.pieces))
+        self.pieces = []
+        self.size = 0
+
+
+def _write(fragments, brackets, json_file, indent, after, end):
+    '''
+    Write the encoded entries between the brackets, as json.dump would,
+    with a line break after every occurrence of "after".
+    '''
+    if indent is None:
+        (opening, separator, closing) = (
+            brackets[0], ', ', brackets[1]
+        )
+    else:
+        pad = '\n' + ' ' * indent
+        (opening, separator, closing) = (
+            brackets[0] + pad, ',' + pad, '\n' + brackets[1]
+        )
+
+    def spaced(text):
+        return text.replace(after, after + '\n') if after else text
+
+    sink = _Sink(json_file)
+    # Each entry is written once the next one shows whether a comma follows,
+    # so that "after" can match across the separator.
+    previous = None
+    for fragment in fragments:
+        if previous is None:
+            sink.write(spaced(opening))
+        else:
+            sink.write(spaced(previous + separator))
+        previous = fragment if indent is None else fragment.replace('\n', pad)
+    if previous is None:
+        sink.write(brackets + end)
+    else:
+        sink.write(spaced(previous + closing) + end)
+    sink.flush()
+
+
+def write_json_items(items, json_file, indent=None, after=None, end=''):
+    '''
+    Write the (key, value) items as a JSON object, one item at a time,
+    as json.dump(dict(items), json_file, indent=indent) would. Items may
+    come from a generator, and numpy values are encoded directly.
+    With "after", there is a line break after each of its occurrences,
+    and "end" is written last, so that this matches:
+    print(json.dumps(dict(items)).replace(after, after + '\\n'))
+
+    >>> import io
+    >>> cells = {'c-1': {'xy': [1, 2], 'genes': {'a': 1}}, 'c-2': {}}
+    >>> cells_file = io.StringIO()
+    >>> write_json_items(cells.items(), cells_file, indent=1)
+    >>> cells_file.getvalue() == json.dumps(cells, indent=1)
+    True
+
+    >>> genes = {'a': {'max': 2, 'cells': {'c-1': 2}}, 'b': {'max': 0}}
+    >>> genes_file = io.StringIO()
+    >>> write_json_items(genes.items(), genes_file, after='},', end='\\n')
+    >>> print(genes_file.getvalue(), end='')
+    {"a": {"max": 2, "cells": {"c-1": 2}},
+     "b": {"max": 0}}
+    >>> spaced = json.dumps(genes).replace('},', '},\\n') + '\\n'
+    >>> genes_file.getvalue() == spaced
+    True
+    '''
+    encode = json.JSONEncoder(default=_default, indent=indent).encode
+    _write(
+        (
+            json.dumps(_key(key)) + ': ' + encode(value)
+            for (key, value) in items
+        ),
+        '{}', json_file, indent, after, end
+    )
+
+
+def write_json(value, json_file, indent=None, after=None, end=''):
+    '''
+    Write the value as write_json_items would: The entries of an object or
+    a list are encoded and written one at a time, rather than as one string.
+
+    >>> import io
+    >>> for value in [{}, [], [1, {'a': [np.int32(2)]}], 'text', {1: None}]:
+    ...     for indent in [None, 1, 2]:
+    ...         value_file = io.StringIO()
+    ...         write_json(value, value_file, indent=indent)
+    ...         expected = json.dumps(value, indent=indent, default=_default)
+    ...         assert value_file.getvalue() == expected, expected
+
+    >>> clusters = {'rows': ['a', 'b'], 'matrix': [[1, 2], [3, 4]]}
+    >>> clusters_file = io.StringIO()
+    >>> write_json(clusters, clusters_file, after='],', end='\\n')
+    >>> print(clusters_file.getvalue(), end='')
+    {"rows": ["a", "b"],
+     "matrix": [[1, 2],
+     [3, 4]]}
+    '''
+    if isinstance(value, dict):
+        write_json_items(value.items(), json_file, indent, after, end)
+    elif isinstance(value, (list, tuple)):
+        encode = json.JSONEncoder(default=_default, indent=indent).encode
+        _write(
+            (encode(element) for element in value),
+            '[]', json_file, indent, after, end
+        )
+    else:
+        text = json.dumps(value, indent=indent, default=_default)
+        json_file.write(
+            (text.replace(after, after + '\n') if after else text) + end
+        )
@@ -1,42 +1,193 @@
 import loompy
+import numpy as np
+import pandas
 from collections import namedtuple
+from functools import lru_cache
+
+# Number of cells to read from the matrix at once.
+BLOCK_SIZE = 4096
+# Number of gene rows, and of cell columns, to keep after reading them.
+CACHE_SIZE = 1024
+# Every column attribute used below.
+CELL_ATTRIBUTES = [
+    'Valid', 'CellID', '_tSNE_1', '_tSNE_2',
+    'ClusterID', 'ClusterName', 'X', 'Y'
+]
 
 
 class LoomReader:
-    def __init__(self, filename):
+    def __init__(self, filename, cache_size=CACHE_SIZE):
         self.ds = loompy.connect(filename)
 
-        self.cells = list(self.ds.ca['CellID'])
+        # Column attributes are read once, into one table.
+        self.table = pandas.DataFrame(
+            {name: self.ds.ca[name] for name in CELL_ATTRIBUTES},
+            columns=CELL_ATTRIBUTES
+        )
+        self.valid_table = self.table[self.table['Valid'] != 0]
+        # As in data(), each valid cell is listed once.
+        self.valid_cells = list(dict.fromkeys(self.valid_table['CellID']))
+
+        self.cells = list(self.table['CellID'])
         self.genes = list(self.ds.ra['Gene'])
+        # Like a mask on the attribute, these find the first match.
+        self.cell_columns = {}
+        for (column, cell_id) in enumerate(self.cells):
+            self.cell_columns.setdefault(cell_id, column)
+        self.gene_rows = {}
+        for (row, gene) in enumerate(self.genes):
+            self.gene_rows.setdefault(gene, row)
+
+        self.cell_column = lru_cache(maxsize=cache_size)(self._cell_column)
+        self.gene_row = lru_cache(maxsize=cache_size)(self._gene_row)
+
+    def _cell_column(self, column):
+        return tuple(self.ds[:, column].tolist())
+
+    def _gene_row(self, row):
+        return tuple(self.ds[row, :].tolist())
+
+    def valid_columns(self, *names):
+        '''
+        Returns the values of the attributes for the valid cells.
+        '''
+        return [self.valid_table[name].values for name in names]
 
     def data(self):
         '''
         Returns all data for each cell.
+        The matrix is read once, in blocks of contiguous columns.
+
+        >>> lr = LoomReader('fake-files/input/linnarsson/\
+linnarsson.cells.loom')
+        >>> cells = lr.data()
+        >>> len(cells)
+        4839
+        >>> cells['42']['genes']['Gad2']
+        7
+        '''
+        return self._cells(self.valid_table)
+
+    def batches(self, batch_size):
+        '''
+        Yields the data for each cell, as from data(), for batch_size cells
+        at a time: Only their span of the matrix is read.
+
+        >>> lr = LoomReader('fake-files/input/linnarsson/\
+linnarsson.cells.loom')
+        >>> [len(batch) for batch in lr.batches(2000)]
+        [2000, 2000, 839]
+        '''
+        for start in range(0, len(self.valid_table), batch_size):
+            yield self._cells(
+                self.valid_table.iloc[start:start + batch_size]
+            )
+
+    def matrix(self):
+        '''
+        Returns the cells-by-genes array of values for the valid cells,
+        with the IDs of the cells and the genes.
+
+        >>> lr = LoomReader('fake-files/input/linnarsson/\
+linnarsson.cells.loom')
+        >>> matrix, cell_ids, genes = lr.matrix()
+        >>> matrix.shape
+        (4839, 33)
+        >>> matrix[cell_ids.index('42'), genes.index('Gad2')]
+        7
+        '''
+        return next(self.gene_batches(max(len(self.genes), 1)))
+
+    def gene_batches(self, batch_size):
         '''
+        Yields the cells-by-genes array of values for the valid cells and
+        batch_size genes, with the IDs of the cells and the genes,
+        until all genes are read.
+
+        >>> lr = LoomReader('fake-files/input/linnarsson/\
+linnarsson.cells.loom')
+        >>> batches = list(lr.gene_batches(20))
+        >>> [(len(cell_ids), genes[0], matrix.shape)
+        ...  for (matrix, cell_ids, genes) in batches]
+        [(4839, 'Gad2', (4839, 20)), (4839, 'Bmp4', (4839, 13))]
+        '''
+        # As in data(), each cell's values come from its first column.
+        columns = [self.cell_columns[cell_id] for cell_id in self.valid_cells]
+        for start in range(0, len(self.genes), batch_size):
+            block = self.ds[start:start + batch_size, :][:, columns]
+            yield (
+                block.T.astype(int),
+                self.valid_cells,
+                self.genes[start:start + batch_size]
+            )
+
+    def cell_batches(self, batch_size):
+        '''
+        Yields the cells-by-genes array of values for batch_size valid
+        cells at a time, with the IDs of the cells and the genes.
+
+        >>> lr = LoomReader('fake-files/input/linnarsson/\
+linnarsson.cells.loom')
+        >>> batches = list(lr.cell_batches(2000))
+        >>> [matrix.shape for (matrix, cell_ids, genes) in batches]
+        [(2000, 33), (2000, 33), (839, 33)]
+        >>> matrix, cell_ids, genes = batches[0]
+        >>> matrix[0].tolist() == list(lr.by_cell(cell_ids[0]).values())
+        True
+        '''
+        for start in range(0, len(self.valid_cells), batch_size):
+            cell_ids = self.valid_cells[start:start + batch_size]
+            yield (
+                self._read_columns(
+                    [self.cell_columns[cell_id] for cell_id in cell_ids]
+                ).T,
+                cell_ids,
+                self.genes
+            )
+
+    def _cells(self, table):
+        '''
+        Returns the data for each cell in the table.
+        '''
+        columns = sorted(set(
+            self.cell_columns[cell_id] for cell_id in table['CellID'].values
+        ))
+        genes_by_column = dict(zip(columns, (
+            dict(zip(self.genes, values))
+            for values in self._read_columns(columns).T.tolist()
+        )))
+
         cells = {}
-        data_zip = zip(
-            self.ds.ca['Valid'],
-            self.ds.ca['CellID'],
-            self.ds.ca['_tSNE_1'],
-            self.ds.ca['_tSNE_2'],
-            self.ds.ca['ClusterID'],
-            self.ds.ca['ClusterName'],
-            self.ds.ca['X'],
-            self.ds.ca['Y']
-        )
-        for (valid, cell_id, tsne1, tsne2,
-             cluster_id, cluster_name, x, y) in data_zip:
-            if valid:
-                cells[cell_id] = {
-                    'mappings': {
-                        't-SNE': [tsne1, tsne2]
-                    },
-                    'cluster': cluster_name,
-                    'genes': self.by_cell(cell_id),
-                    'xy': [x, y]
-                }
+        data_zip = zip(*[
+            table[name].values for name in
+            ['CellID', '_tSNE_1', '_tSNE_2', 'ClusterName', 'X', 'Y']
+        ])
+        for (cell_id, tsne1, tsne2, cluster_name, x, y) in data_zip:
+            cells[cell_id] = {
+                'mappings': {
+                    't-SNE': [tsne1, tsne2]
+                },
+                'cluster': cluster_name,
+                'genes': genes_by_column[self.cell_columns[cell_id]],
+                'xy': [x, y]
+            }
         return cells
 
+    def _read_columns(self, columns):
+        '''
+        Returns the genes-by-columns array of values, reading their span
+        of the matrix in blocks of contiguous columns.
+        '''
+        columns = np.array(columns, dtype=np.int64)
+        values = np.zeros((len(self.genes), len(columns)), dtype=int)
+        if len(columns):
+            for start in range(columns.min(), columns.max() + 1, BLOCK_SIZE):
+                inside = (columns >= start) & (columns < start + BLOCK_SIZE)
+                if inside.any():
+                    block = self.ds[:, start:start + BLOCK_SIZE]
+                    values[:, inside] = block[:, columns[inside] - start]
+        return values
+
     def clusters(self):
         '''
         Returns information about each cluster.
@@ -52,18 +203,14 @@ linnarsson.cells.loom')
         clusters = {}
         Cluster = namedtuple('Cluster', ['name', 'cell_ids'])
 
-        clustered_cell_zip = zip(
-            self.ds.ca['Valid'],
-            self.ds.ca['ClusterID'],
-            self.ds.ca['ClusterName'],
-            self.ds.ca['CellID']
-        )
-        for (valid, cluster_id, cluster_name, cell_id) in clustered_cell_zip:
-            if valid:
-                if cluster_id in clusters:
-                    clusters[cluster_id].cell_ids.append(cell_id)
-                else:
-                    clusters[cluster_id] = Cluster(cluster_name, [cell_id])
+        clustered_cell_zip = zip(*self.valid_columns(
+            'ClusterID', 'ClusterName', 'CellID'
+        ))
+        for (cluster_id, cluster_name, cell_id) in clustered_cell_zip:
+            if cluster_id in clusters:
+                clusters[cluster_id].cell_ids.append(cell_id)
+            else:
+                clusters[cluster_id] = Cluster(cluster_name, [cell_id])
         return clusters
 
     def tsne(self):
@@ -78,15 +225,9 @@ linnarsson.cells.loom')
         '''
         cells = {}
 
-        tsne_zip = zip(
-            self.ds.ca['Valid'],
-            self.ds.ca['CellID'],
-            self.ds.ca['_tSNE_1'],
-            self.ds.ca['_tSNE_2']
-        )
-        for (valid, cell_id, tsne1, tsne2) in tsne_zip:
-            if valid:
-                cells[cell_id] = (tsne1, tsne2)
+        tsne_zip = zip(*self.valid_columns('CellID', '_tSNE_1', '_tSNE_2'))
+        for (cell_id, tsne1, tsne2) in tsne_zip:
+            cells[cell_id] = (tsne1, tsne2)
         return cells
 
     def xy(self):
@@ -101,41 +242,45 @@ linnarsson.cells.loom')
         '''
         cells = {}
 
-        tsne_zip = zip(
-            self.ds.ca['Valid'],
-            self.ds.ca['CellID'],
-            self.ds.ca['X'],
-            self.ds.ca['Y']
-        )
-        for (valid, cell_id, x, y) in tsne_zip:
-            if valid:
-                cells[cell_id] = (x, y)
+        xy_zip = zip(*self.valid_columns('CellID', 'X', 'Y'))
+        for (cell_id, x, y) in xy_zip:
+            cells[cell_id] = (x, y)
         return cells
 
     def by_cell(self, cell_id):
         '''
         Given a cell_id, returns a dict with the values for each gene.
+        The column is read once, and kept for the next lookups.
 
         >>> lr = LoomReader('fake-files/input/linnarsson/\
 linnarsson.cells.loom')
         >>> lr.by_cell('42')['Gad2']
         7
+        >>> lr.by_cell('42')['Gad2']
+        7
+        >>> lr.cell_column.cache_info()
+        CacheInfo(hits=1, misses=1, maxsize=1024, currsize=1)
         '''
         return dict(zip(
             self.genes,
-            (int(x[0]) for x in self.ds[:, self.ds.ca.CellID == cell_id])
+            (int(x) for x in self.cell_column(self.cell_columns[cell_id]))
         ))
 
     def by_gene(self, gene):
         '''
         Given a gene, returns a dict with the values for each cell.
+        The row is read once, and kept for the next lookups.
 
         >>> lr = LoomReader('fake-files/input/linnarsson/\
 linnarsson.cells.loom')
         >>> lr.by_gene('Gad2')['42']
         7
+        >>> lr.by_gene('Gad2')['42']
+        7
+        >>> lr.gene_row.cache_info()
+        CacheInfo(hits=1, misses=1, maxsize=1024, currsize=1)
         '''
         return dict(zip(
             self.cells,
-            self.ds[self.ds.ra.Gene == gene, :].tolist()[0]
+            self.gene_row(self.gene_rows[gene])
         ))
@@ -0,0 +1,287 @@
+import numpy as np
+import zarr
+from numcodecs import Zlib
+
+from img_hdf5_reader import DEFAULT_TILE_SIZE, create_dimensions
+from zarr_writer import write_arrays
+
+# Most molecules in each tile of a coarser level.
+TILE_POINTS = 10000
+# Deepest level of tiles, which holds every molecule.
+MAX_LEVEL = 10
+# Pixels along the longer side of the density rasters.
+DENSITY_SIZE = 2048
+
+
+def write_molecules_zarr(path, batches):
+    '''
+    Write the molecules to a zarr store: The [x, y] of every gene's
+    molecules, one gene after another, as float32 "coords", and the
+    "offsets" at which each gene starts and ends, with the genes, in order,
+    as an attribute. batches is a function which returns an iterator over
+    (gene, [x, y] array) pairs, with each gene's pairs together. Arrays are
+    one uncompressed chunk, so the molecules of one gene are a single byte
+    range of the coords chunk.
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'molecules.zarr')
+    >>> write_molecules_zarr(path, lambda: [
+    ...   ('Gad2', [[1, 2]]), ('Gad2', [[3, 4]]), ('Vip', []),
+    ...   ('Aldoc', [[5.5, 6]])
+    ... ])
+    >>> group = zarr.open_group(path, mode='r')
+    >>> group.attrs['genes']
+    ['Gad2', 'Vip', 'Aldoc']
+    >>> group['offsets'][:].tolist()
+    [0, 2, 2, 3]
+
+    A client only needs the offsets to read one gene:
+
+    >>> (start, stop) = group['offsets'][2:4] * 8
+    >>> with open(os.path.join(path, 'coords', '0.0'), 'rb') as chunk:
+    ...     _ = chunk.seek(start)
+    ...     np.frombuffer(chunk.read(stop - start), dtype='<f4').tolist()
+    [5.5, 6.0]
+    '''
+    (genes, coords, codes) = _concatenate(batches)
+    offsets = np.cumsum(
+        np.concatenate(([0], np.bincount(codes, minlength=len(genes))))
+    )
+
+    group = zarr.open_group(path, mode='w-')
+    group.attrs['genes'] = genes
+    write_arrays(group, [
+        ('coords', coords.astype('<f4')),
+        ('offsets', offsets.astype('<u4'))
+    ])
+
+
+def _concatenate(batches):
+    '''
+    Returns the genes, in order, the [x, y] of every molecule, as float32,
+    and the index of each molecule's gene. Each batch is converted as it
+    is read, so only the float32 copy of every molecule is kept.
+
+    >>> (genes, coords, codes) = _concatenate(lambda: [
+    ...   ('B', [[1, 2]]), ('B', [[3, 4]]), ('A', np.zeros((0, 2)))
+    ... ])
+    >>> genes, coords.tolist(), codes.tolist()
+    (['B', 'A'], [[1.0, 2.0], [3.0, 4.0]], [0, 0])
+    '''
+    genes = []
+    arrays = []
+    codes = []
+    for (gene, coords) in batches():
+        if not genes or genes[-1] != gene:
+            genes.append(gene)
+        arrays.append(np.asarray(coords, dtype=np.float32).reshape(-1, 2))
+        codes.append(np.full(len(arrays[-1]), len(genes) - 1, np.int64))
+    if not arrays:
+        return genes, np.zeros((0, 2), np.float32), np.zeros(0, np.int64)
+    return genes, np.concatenate(arrays), np.concatenate(codes)
+
+
+def _tiles(coords, origin, size, level):
+    '''
+    Returns the index of the tile of each point at the level,
+    counting across, then down, the 2^level by 2^level tiles.
+
+    >>> _tiles(np.array([[0, 0], [3, 1], [1, 3], [4, 4]]), [0, 0], 4, 1)
+    array([0, 1, 2, 3])
+    '''
+    across = 2 ** level
+    (x, y) = (
+        np.clip(
+            ((coords[:, i] - origin[i]) / size * across).astype(np.int64),
+            0, across - 1
+        )
+        for i in range(2)
+    )
+    return y * across + x
+
+
+def write_tiles_zarr(path, batches, tile_points=TILE_POINTS,
+                     max_level=MAX_LEVEL, random_state=0):
+    '''
+    Write the molecules, from batches as write_molecules_zarr reads them,
+    to a zarr store as a quadtree of tiles: Level z splits the square
+    around all the molecules into 2^z by 2^z tiles, and holds at most
+    tile_points molecules in each. The deepest level, the first where no
+    tile is over, holds every molecule. Coarser levels keep the molecules
+    with the lowest random priorities, so each level holds every molecule
+    of the coarser levels.
+
+    For each level, the "coords" and "genes" of its molecules are ordered
+    by tile, and "offsets" gives where each tile starts and ends, so that
+    one tile is a byte range of each chunk. The genes, the "origin" and
+    "size" of the square, and the number of "levels" are attributes.
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'tiles.zarr')
+    >>> write_tiles_zarr(path, {
+    ...   'Gad2': [[0, 0], [1, 1], [3, 3]], 'Vip': [[9, 9], [7, 1]]
+    ... }.items, tile_points=2)
+    >>> group = zarr.open_group(path, mode='r')
+    >>> group.attrs['levels'], group.attrs['origin'], group.attrs['size']
+    (3, [0.0, 0.0], 9.0)
+    >>> group['0/coords'][:].tolist()
+    [[9.0, 9.0], [7.0, 1.0]]
+    >>> group['1/offsets'][:].tolist()
+    [0, 2, 3, 3, 4]
+    >>> group['1/coords'][:].tolist()
+    [[0.0, 0.0], [3.0, 3.0], [7.0, 1.0], [9.0, 9.0]]
+    >>> group['1/genes'][:].tolist()
+    [0, 0, 1, 1]
+    >>> group['2/offsets'][-1]
+    5
+    '''
+    (genes, coords, codes) = _concatenate(batches)
+    priorities = np.random.RandomState(random_state).random_sample(
+        len(coords)
+    )
+    if len(coords):
+        origin = coords.min(axis=0).astype(np.float64)
+        size = float((coords.max(axis=0) - origin).max()) or 1.0
+    else:
+        (origin, size) = (np.zeros(2), 1.0)
+
+    levels = 1
+    while levels <= max_level:
+        counts = np.bincount(_tiles(coords, origin, size, levels - 1))
+        if not len(counts) or counts.max() <= tile_points:
+            break
+        levels += 1
+    levels = min(levels, max_level + 1)
+
+    group = zarr.open_group(path, mode='w-')
+    group.attrs['genes'] = genes
+    group.attrs['origin'] = origin.tolist()
+    group.attrs['size'] = size
+    group.attrs['levels'] = levels
+    gene_dtype = '<u2' if len(genes) <= 2 ** 16 else '<u4'
+    for level in range(levels):
+        tiles = _tiles(coords, origin, size, level)
+        order = np.lexsort((priorities, tiles))
+        counts = np.bincount(tiles, minlength=4 ** level)
+        if level < levels - 1:
+            # Rank of each molecule in its tile, by priority:
+            starts = np.cumsum(counts) - counts
+            ranks = np.arange(len(order)) - starts[tiles[order]]
+            order = order[ranks < tile_points]
+            counts = np.minimum(counts, tile_points)
+        # Within a tile, molecules stay in their original order.
+        order = order[np.lexsort((order, tiles[order]))]
+        level_group = group.create_group(str(level))
+        write_arrays(level_group, [
+            ('coords', coords[order].astype('<f4')),
+            ('genes', codes[order].astype(gene_dtype)),
+            ('offsets', np.cumsum(
+                np.concatenate(([0], counts))).astype('<u4'))
+        ])
+
+
+def _sum_blocks(counts):
+    '''
+    Returns the sum of each 2 by 2 block of pixels, with a row or column
+    of zeros added first if there is an odd number, so no count is lost.
+
+    >>> _sum_blocks(np.arange(6).reshape(2, 3)).tolist()
+    [[8, 7]]
+    '''
+    (height, width) = counts.shape
+    padded = np.pad(counts, ((0, height % 2), (0, width % 2)), 'constant')
+    return padded.reshape(
+        padded.shape[0] // 2, 2, padded.shape[1] // 2, 2
+    ).sum(axis=(1, 3), dtype=counts.dtype)
+
+
+def write_density_zarr(path, batches, size=DENSITY_SIZE,
+                       tile_size=DEFAULT_TILE_SIZE):
+    '''
+    Write the number of molecules of each gene in each pixel, as a zarr
+    image pyramid with a channel for each gene. batches is a function which
+    returns an iterator over (gene, [x, y] array) pairs, with each gene's
+    pairs together: It is read twice, first for the bounds. Pixels are
+    "bin_size" wide, from the "origin", which are attributes of the base
+    image. Each coarser level sums 2 by 2 blocks of the one before, until
+    the image fits in a tile, so every level counts every molecule.
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'density.zarr')
+    >>> molecules = {
+    ...   'Gad2': np.array([[0, 0], [1, 1], [3, 3], [3.5, 3]]),
+    ...   'Vip': np.array([[4, 2]])
+    ... }
+    >>> write_density_zarr(path, molecules.items, size=2, tile_size=1)
+    >>> group = zarr.open_group(path, mode='r')
+    >>> image = group['0']
+    >>> image.attrs['origin'], image.attrs['bin_size']
+    ([0.0, 0.0], 2.0)
+    >>> image[:].tolist()
+    [[[2, 0, 0], [0, 2, 0]], [[0, 0, 0], [0, 0, 1]]]
+    >>> [d['values'] for d in image.attrs['dimensions']][0]
+    ['Gad2', 'Vip']
+    >>> [group[level].shape for level in sorted(group)]
+    [(2, 2, 3), (2, 1, 2), (2, 1, 1)]
+    >>> [group[level][:].sum(axis=(1, 2)).tolist() for level in sorted(group)]
+    [[4, 1], [4, 1], [4, 1]]
+    '''
+    genes = []
+    (low, high) = (None, None)
+    for (gene, coords) in batches():
+        if not genes or genes[-1] != gene:
+            genes.append(gene)
+        if len(coords):
+            coords = np.asarray(coords, dtype=np.float64)
+            (batch_low, batch_high) = (coords.min(axis=0), coords.max(axis=0))
+            (low, high) = (
+                (batch_low, batch_high) if low is None else
+                (np.minimum(low, batch_low), np.maximum(high, batch_high))
+            )
+    if low is None:
+        (low, high) = (np.zeros(2), np.zeros(2))
+    origin = np.floor(low)
+    bin_size = max(1.0, float(np.ceil((high - origin).max() / size)))
+    (width, height) = ((high - origin) // bin_size).astype(np.int64) + 1
+
+    group = zarr.open_group(path, mode='w-')
+    shape = (int(height), int(width))
+    images = []
+    while True:
+        images.append(group.create(
+            str(len(images)), shape=(len(genes),) + shape,
+            chunks=(1, tile_size, tile_size), dtype='<u4',
+            compressor=Zlib(level=1)
+        ))
+        if max(shape) <= tile_size:
+            break
+        shape = tuple((side + 1) // 2 for side in shape)
+    images[0].attrs['dimensions'] = create_dimensions(genes)
+    images[0].attrs['origin'] = origin.tolist()
+    images[0].attrs['bin_size'] = bin_size
+
+    def write_channel(channel, counts):
+        counts = counts.reshape(height, width)
+        for image in images:
+            image[channel] = counts
+            counts = _sum_blocks(counts)
+
+    channel = -1
+    counts = None
+    for (gene, coords) in batches():
+        if channel < 0 or gene != genes[channel]:
+            if counts is not None:
+                write_channel(channel, counts)
+            channel += 1
+            counts = np.zeros(height * width, dtype=np.uint32)
+        pixels = (
+            (np.asarray(coords, dtype=np.float64).reshape(-1, 2) - origin)
+            // bin_size
+        ).astype(np.int64)
+        counts += np.bincount(
+            pixels[:, 1] * width + pixels[:, 0], minlength=len(counts)
+        ).astype(np.uint32)
+    if counts is not None:
+        write_channel(channel, counts)
+
+    zarr.consolidate_metadata(group.store)
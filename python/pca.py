@@ -0,0 +1,144 @@
+import numpy as np
+from scipy import linalg
+from sklearn.decomposition import IncrementalPCA
+
+# Ways to find the principal axes, each reading the matrix in row batches:
+# - 'full' is exact, from the feature means and scatter matrix,
+#   which take features^2 memory.
+# - 'incremental' is sklearn's IncrementalPCA, approximate, one pass.
+# - 'randomized' is a randomized SVD, which keeps a few values per row,
+#   and takes two passes for each power iteration.
+MODES = ['full', 'incremental', 'randomized']
+# Extra random directions for the randomized SVD, as in sklearn.
+OVERSAMPLES = 10
+
+
+def principal_components(batches, n_components=2, mode='full',
+                         n_iter=4, random_state=0):
+    '''
+    Returns the principal components of the rows of a matrix. batches is
+    a function which returns an iterator over its row batches, as arrays:
+    Each mode reads the matrix more than once. The signs follow sklearn:
+    The largest component of each column is positive.
+
+    >>> matrix = np.array([[0, 0, 1, 0], [1, 1, 0, 1], [0, 4, 0, 4]])
+    >>> def batches():
+    ...     return iter([matrix[:2], matrix[2:]])
+    >>> principal_components(batches).round(2).tolist()
+    [[-2.41, -0.57], [-0.92, 0.77], [3.33, -0.2]]
+    >>> principal_components(batches, mode='randomized').round(2).tolist()
+    [[-2.41, -0.57], [-0.92, 0.77], [3.33, -0.2]]
+    >>> principal_components(
+    ...     batches, n_components=1, mode='incremental').round(2).tolist()
+    [[-2.41], [-0.92], [3.33]]
+
+    The last batch may have fewer rows than n_components:
+
+    >>> principal_components(batches, mode='incremental').round(2).tolist()
+    [[-2.41, -0.57], [-0.92, 0.77], [3.33, -0.2]]
+    '''
+    if mode == 'full':
+        mean, components = _fit_full(batches(), n_components)
+    elif mode == 'incremental':
+        mean, components = _fit_incremental(batches(), n_components)
+    elif mode == 'randomized':
+        mean, components = _fit_randomized(
+            batches, n_components, n_iter, random_state
+        )
+    else:
+        raise ValueError('Unknown PCA mode: {}'.format(mode))
+    scores = _stack(
+        (batch - mean).dot(components.T) for batch in batches()
+    )
+    if len(scores):
+        largest = scores[np.abs(scores).argmax(axis=0), range(n_components)]
+        scores *= np.where(largest < 0, -1, 1)
+    return scores
+
+
+def _stack(arrays):
+    arrays = list(arrays)
+    return np.concatenate(arrays) if arrays else np.zeros((0, 0))
+
+
+def _fit_full(batches, n_components):
+    count = 0
+    shift = None
+    for batch in batches:
+        values = np.asarray(batch, dtype=np.float64)
+        if shift is None:
+            # Shifting by a rough mean keeps the sums well-conditioned.
+            shift = values.mean(axis=0)
+            total = np.zeros_like(shift)
+            scatter = np.zeros((len(shift), len(shift)))
+        values = values - shift
+        count += len(values)
+        total += values.sum(axis=0)
+        scatter += values.T.dot(values)
+    mean = total / count
+    covariance = scatter / count - np.outer(mean, mean)
+    _, vectors = linalg.eigh(covariance)
+    return shift + mean, vectors[:, ::-1][:, :n_components].T
+
+
+def _fit_incremental(batches, n_components):
+    '''
+    Each partial fit needs at least n_components rows: Short batches are
+    joined with the next, and the last chunk is held back until the end,
+    so that a short tail can be joined with it.
+
+    >>> matrix = np.array([[0, 0, 1], [1, 1, 0], [0, 4, 0], [2, 0, 1]])
+    >>> mean, components = _fit_incremental(
+    ...     iter([matrix[:2], matrix[2:3], matrix[3:]]), 2)
+    >>> mean.tolist(), components.shape
+    ([0.75, 1.25, 0.5], (2, 3))
+    '''
+    incremental = IncrementalPCA(n_components=n_components)
+    rows = []
+    held = None
+    for batch in batches:
+        rows.append(np.asarray(batch, dtype=np.float64))
+        if sum(len(r) for r in rows) >= n_components:
+            if held is not None:
+                incremental.partial_fit(held)
+            held = np.concatenate(rows)
+            rows = []
+    if held is not None:
+        rows.insert(0, held)
+    if rows:
+        incremental.partial_fit(np.concatenate(rows))
+    return incremental.mean_, incremental.components_
+
+
+def _fit_randomized(batches, n_components, n_iter, random_state):
+    # Halko et al., "Finding structure with randomness", algorithm 4.4,
+    # with each product by the centered matrix taken one batch at a time.
+    count = 0
+    total = 0
+    for batch in batches():
+        count += len(batch)
+        total = total + np.asarray(batch, dtype=np.float64).sum(axis=0)
+    mean = total / count
+
+    def multiply(vectors):
+        return _stack((batch - mean).dot(vectors) for batch in batches())
+
+    def multiply_transposed(vectors):
+        product = 0
+        start = 0
+        for batch in batches():
+            end = start + len(batch)
+            product = product + (batch - mean).T.dot(vectors[start:end])
+            start = end
+        return product
+
+    n_random = min(n_components + OVERSAMPLES, len(mean))
+    omega = np.random.RandomState(random_state).normal(
+        size=(len(mean), n_random)
+    )
+    q = linalg.qr(multiply(omega), mode='economic')[0]
+    for _ in range(n_iter):
+        q = linalg.qr(multiply_transposed(q), mode='economic')[0]
+        q = linalg.qr(multiply(q), mode='economic')[0]
+    _, _, vt = linalg.svd(multiply_transposed(q).T, full_matrices=False)
+    return mean, vt[:n_components]
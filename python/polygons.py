@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import pickle
+
+import numpy as np
+import zarr
+
+from zarr_writer import write_arrays
+
+# Levels of detail, from the most to the least.
+LEVELS = ['full', 'hull', 'octagon', 'centroid']
+# Simplified hulls keep the farthest vertex in this many directions.
+HULL_DIRECTIONS = 16
+# Those directions are rounded to integer vectors about this long.
+DIRECTION_SCALE = 1 << 12
+# Extremes of the vertices which bound an octagon: y - x is "diff".
+OCTAGON_BOUNDS = [
+    'min_x', 'max_x', 'min_y', 'max_y',
+    'min_sum', 'max_sum', 'min_diff', 'max_diff'
+]
+
+
+class PolygonStore:
+    '''
+    Polygons as one flat array of vertices, and the offsets at which each
+    polygon starts and ends, so that all of them can be simplified at once
+    with reductions over the segments.
+
+    >>> store = PolygonStore.from_dict({
+    ...   'square': [[0, 0], [0, 1], [1, 1], [1, 0]],
+    ...   'triangle': [[1, 0], [0, 2], [2, 3]]
+    ... })
+    >>> store.offsets.tolist()
+    [0, 4, 7]
+    >>> store.polygon('triangle').tolist()
+    [[1, 0], [0, 2], [2, 3]]
+    >>> store.centroids().tolist()
+    [[0.5, 0.5], [1.0, 1.6666666666666667]]
+    >>> octagons = store.octagons()
+    >>> octagons.tolist()[1]
+    [[0, 1], [0, 2], [1, 3], [2, 3], [2, 3], [2, 1], [1, 0], [1, 0]]
+    '''
+    def __init__(self, ids, coords, offsets):
+        self.ids = list(ids)
+        self.coords = np.asanyarray(coords).reshape(-1, 2)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        if len(self.offsets) != len(self.ids) + 1:
+            raise ValueError('Need one more offset than polygons')
+        if np.any(np.diff(self.offsets) < 1):
+            raise ValueError('Each polygon needs at least one vertex')
+        self.rows = {}
+        for (row, polygon_id) in enumerate(self.ids):
+            self.rows.setdefault(polygon_id, row)
+
+    @classmethod
+    def from_dict(cls, polygons):
+        '''
+        Given a dict of vertex lists or arrays, keyed by ID,
+        returns a store of the polygons.
+        '''
+        ids = list(polygons.keys())
+        arrays = [np.asarray(polygons[i]).reshape(-1, 2) for i in ids]
+        offsets = np.cumsum([0] + [len(array) for array in arrays])
+        coords = np.concatenate(arrays) if arrays else np.zeros((0, 2))
+        return cls(ids, coords, offsets)
+
+    def save(self, path):
+        '''
+        Write the store to a new directory, as .npy arrays which load()
+        can map into memory, with the IDs as JSON.
+        '''
+        os.makedirs(path)
+        np.save(os.path.join(path, 'coords.npy'), self.coords)
+        np.save(os.path.join(path, 'offsets.npy'), self.offsets)
+        with open(os.path.join(path, 'ids.json'), 'w') as ids_file:
+            json.dump(self.ids, ids_file)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Open a store written by save(). The coordinates are memory-mapped,
+        so only the polygons which are used are read.
+
+        >>> import tempfile
+        >>> store = PolygonStore.from_dict({'a': [[0, 0]], 'b': [[1, 2]]})
+        >>> path = os.path.join(tempfile.mkdtemp(), 'polygons')
+        >>> store.save(path)
+        >>> loaded = PolygonStore.load(path)
+        >>> type(loaded.coords)
+        <class 'numpy.memmap'>
+        >>> loaded.polygon('b').tolist()
+        [[1, 2]]
+        '''
+        with open(os.path.join(path, 'ids.json')) as ids_file:
+            ids = json.load(ids_file)
+        offsets = np.load(os.path.join(path, 'offsets.npy'))
+        # An empty file can not be mapped.
+        mmap_mode = 'r' if offsets[-1] else None
+        coords = np.load(os.path.join(path, 'coords.npy'), mmap_mode=mmap_mode)
+        return cls(ids, coords, offsets)
+
+    def select(self, ids):
+        '''
+        Returns a store of just the polygons with these IDs, in order,
+        skipping IDs which are not in this store.
+
+        >>> store = PolygonStore.from_dict({
+        ...   'a': [[0, 0]], 'b': [[1, 1], [2, 2]], 'c': [[3, 3]]
+        ... })
+        >>> selected = store.select(['c', 'x', 'b'])
+        >>> selected.ids
+        ['c', 'b']
+        >>> selected.tolist()
+        [[[3, 3]], [[1, 1], [2, 2]]]
+        '''
+        ids = [i for i in ids if i in self.rows]
+        rows = np.array([self.rows[i] for i in ids], dtype=np.int64)
+        starts = self.offsets[rows]
+        lengths = self.offsets[rows + 1] - starts
+        offsets = np.cumsum(np.concatenate(([0], lengths)))
+        # The index of each selected vertex in coords.
+        vertices = (
+            np.repeat(starts - offsets[:-1], lengths)
+            + np.arange(offsets[-1])
+        )
+        return PolygonStore(ids, self.coords[vertices], offsets)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def polygon(self, polygon_id):
+        row = self.rows[polygon_id]
+        return self.coords[self.offsets[row]:self.offsets[row + 1]]
+
+    def tolist(self):
+        '''
+        Returns the polygons as lists of [x, y] vertices.
+        '''
+        lengths = np.diff(self.offsets)
+        if len(lengths) and np.all(lengths == lengths[0]):
+            return self.coords.reshape(len(self), -1, 2).tolist()
+        return [
+            self.coords[start:end].tolist()
+            for (start, end) in zip(self.offsets[:-1], self.offsets[1:])
+        ]
+
+    def _reduce(self, ufunc, values):
+        if not len(self):
+            return values[:0]
+        return ufunc.reduceat(values, self.offsets[:-1])
+
+    def centroids(self):
+        '''
+        Returns the mean of the vertices of each polygon.
+        '''
+        counts = np.diff(self.offsets)[:, np.newaxis]
+        return self._reduce(np.add, self.coords.astype(np.float64)) / counts
+
+    def hulls(self, directions=HULL_DIRECTIONS):
+        '''
+        Returns a store of simplified convex hulls: Of each polygon's
+        vertices, those which are farthest in one of the evenly spaced
+        directions, counter-clockwise. Of vertices equally far, the one
+        farthest clockwise is kept, and then the first.
+
+        >>> store = PolygonStore.from_dict({
+        ...   'square': [[0, 0], [2, 0], [1, 1], [2, 2], [0, 2]],
+        ...   'point': [[5, 5]]
+        ... })
+        >>> store.hulls(4).tolist()
+        [[[2, 0], [2, 2], [0, 2], [0, 0]], [[5, 5]]]
+        >>> store.hulls(8).tolist()[0]
+        [[2, 2], [0, 2], [0, 0], [2, 0]]
+        '''
+        if not len(self):
+            return self
+        angles = 2 * np.pi * np.arange(directions) / directions
+        # Directions are integer vectors, and projections are computed one
+        # element at a time rather than by a BLAS dot product, so that ties
+        # are exact for integer coordinates, and the same on every run.
+        (dx, dy) = np.round(
+            np.array([np.cos(angles), np.sin(angles)]) * DIRECTION_SCALE
+        ).astype(np.int64)
+        coords = (
+            self.coords.astype(np.int64)
+            if np.issubdtype(self.coords.dtype, np.integer)
+            else self.coords.astype(np.float64)
+        )
+        (x, y) = (coords[:, :1], coords[:, 1:])
+        projections = x * dx + y * dy
+        # ... and onto the direction a quarter turn clockwise, for ties:
+        clockwise = x * dy - y * dx
+        starts = self.offsets[:-1]
+        segments = np.repeat(np.arange(len(self)), np.diff(self.offsets))
+        ties = projections == np.maximum.reduceat(
+            projections, starts
+        )[segments]
+        tied = np.where(ties, clockwise, clockwise.min())
+        ties &= tied == np.maximum.reduceat(tied, starts)[segments]
+        vertices = np.arange(len(self.coords))[:, np.newaxis]
+        extremes = np.minimum.reduceat(
+            np.where(ties, vertices, len(self.coords)), starts
+        )
+        # ... which repeats for neighboring directions.
+        keep = extremes != np.roll(extremes, 1, axis=1)
+        keep[:, 0] |= ~keep.any(axis=1)
+        return PolygonStore(
+            self.ids,
+            self.coords[extremes[keep]],
+            np.cumsum(np.concatenate(([0], keep.sum(axis=1))))
+        )
+
+    def bounds(self):
+        '''
+        Returns the extremes of each polygon which bound its octagon,
+        as the columns of OCTAGON_BOUNDS. Vertices are truncated
+        to integers first.
+        '''
+        # Was unsigned, and substraction causes underflow.
+        coords = self.coords.astype(np.int64)
+        x, y = coords[:, 0], coords[:, 1]
+        return np.stack([
+            self._reduce(ufunc, values)
+            for values in [x, y, x + y, y - x]
+            for ufunc in [np.minimum, np.maximum]
+        ], axis=1)
+
+    def octagons(self):
+        '''
+        Returns a store of the bounding octagon of each polygon: Vertices
+        are truncated to integers, and each octagon is bounded by the
+        extremes of x, y, x + y, and y - x.
+        '''
+        # SciPy has ConvexHull, but it segfaulted on me: perhaps
+        #   https://github.com/scipy/scipy/issues/9751
+        # ... and even if I fixed it locally,
+        # not sure we want that fragility.
+        #
+        # Also: The goal is really just to get a simplified shape...
+        # A convex hull is too precise in some ways,
+        # while in others it falls short, ie, concavities.
+        #
+        # I kind-of like the obvious artificiality of an octagon.
+        return PolygonStore(
+            self.ids,
+            bounding_octagons(self.bounds()).reshape(-1, 2),
+            np.arange(len(self) + 1) * 8
+        )
+
+
+def bounding_octagons(bounds):
+    '''
+    Given the columns of OCTAGON_BOUNDS for each polygon, returns the
+    eight vertices of each bounding octagon.
+
+    >>> triangle = PolygonStore.from_dict({'t': [[1, 0], [0, 2], [2, 3]]})
+    >>> triangle.bounds().tolist()
+    [[0, 2, 0, 3, 1, 5, -1, 2]]
+    >>> bounding_octagons(triangle.bounds()).tolist()
+    [[[0, 1], [0, 2], [1, 3], [2, 3], [2, 3], [2, 1], [1, 0], [1, 0]]]
+    '''
+    (min_x, max_x, min_y, max_y,
+     min_sum, max_sum, min_diff, max_diff) = np.asarray(bounds).T
+    return np.stack([
+        min_x, min_sum - min_x,
+        min_x, max_diff + min_x,  # ^ Left
+        max_y - max_diff, max_y,
+        max_sum - max_y, max_y,  # ^ Bottom
+        max_x, max_sum - max_x,
+        max_x, min_diff + max_x,  # ^ Right
+        min_y - min_diff, min_y,
+        min_sum - min_y, min_y  # ^ Top
+    ], axis=1).reshape(-1, 8, 2)
+
+
+def write_levels_zarr(path, store, levels=LEVELS):
+    '''
+    Write each level of detail of the polygons to its own group in a zarr
+    store, so the viewer only fetches what it draws: The full outlines,
+    simplified hulls, and octagons as flat coordinates and offsets,
+    and the centroids as coordinates alone. The cell IDs, in the order
+    of the polygons, are an attribute. Each array is one uncompressed
+    chunk.
+
+    >>> import tempfile
+    >>> store = PolygonStore.from_dict({'a': [[0, 0], [2, 0], [2, 2]]})
+    >>> path = os.path.join(tempfile.mkdtemp(), 'polygons.zarr')
+    >>> write_levels_zarr(path, store)
+    >>> group = zarr.open_group(path, mode='r')
+    >>> group.attrs['cells']
+    ['a']
+    >>> sorted(group['octagon'].keys())
+    ['coords', 'offsets']
+    >>> group['centroid/coords'][:]
+    array([[1.3333334, 0.6666667]], dtype=float32)
+    '''
+    group = zarr.open_group(path, mode='w-')
+    group.attrs['cells'] = store.ids
+    for level in levels:
+        if level == 'centroid':
+            arrays = {'coords': store.centroids().astype(np.float32)}
+        else:
+            if level == 'full':
+                polygons = store
+            elif level == 'hull':
+                polygons = store.hulls()
+            else:
+                polygons = store.octagons()
+            integers = np.issubdtype(polygons.coords.dtype, np.integer)
+            arrays = {
+                'coords': polygons.coords.astype(
+                    np.int32 if integers else np.float32
+                ),
+                'offsets': polygons.offsets.astype(np.uint32)
+            }
+        write_arrays(group.create_group(level), arrays)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Convert polygons to a store which can be '
+                    'memory-mapped.')
+    parser.add_argument(
+        '--pkl', type=argparse.FileType('rb'),
+        help='Pickle file with a dict of polygons, keyed by cell ID')
+    parser.add_argument(
+        '--json', type=argparse.FileType('r'),
+        help='JSON file with a dict of polygons, keyed by cell ID')
+    parser.add_argument(
+        '--store', required=True,
+        help='Write the polygons to this new directory.')
+    args = parser.parse_args()
+    if bool(args.pkl) == bool(args.json):
+        parser.error('Give either --pkl or --json')
+
+    polygons = pickle.load(args.pkl) if args.pkl else json.load(args.json)
+    PolygonStore.from_dict(polygons).save(args.store)
@@ -0,0 +1,99 @@
+import numpy as np
+
+# Digits kept for each kind of value, as ('decimals', places) or
+# ('significant', digits): Positions are pixels or microns, embeddings
+# only place a dot on a scatterplot, and scores are shown as labels.
+POLICY = {
+    'position': ('decimals', 2),
+    'embedding': ('decimals', 4),
+    'score': ('significant', 2),
+}
+# Bytes saved are estimated from at most this many values of an array.
+SAMPLE_SIZE = 1000
+
+
+def _saved(values, rounded):
+    '''
+    Estimates the JSON bytes saved by rounding the values, from the
+    lengths of evenly spaced samples of them: Exact for small arrays.
+
+    >>> _saved(np.array([0.123456, 1.5]), np.array([0.12, 1.5]))
+    4
+    >>> _saved(np.full(10 ** 6, 0.123456), np.full(10 ** 6, 0.12))
+    4000000
+    '''
+    (values, rounded) = (values.ravel(), rounded.ravel())
+    scale = 1
+    if values.size > SAMPLE_SIZE:
+        scale = values.size / SAMPLE_SIZE
+        samples = np.linspace(0, values.size - 1, SAMPLE_SIZE).astype(int)
+        (values, rounded) = (values[samples], rounded[samples])
+    # json.dumps writes floats as repr does, apart from NaN and infinity,
+    # which are the same before and after rounding.
+    saved = sum(
+        len(repr(value)) - len(repr(short))
+        for (value, short) in zip(values.tolist(), rounded.tolist())
+    )
+    return int(round(saved * scale))
+
+
+def round_values(values, kind, report=None):
+    '''
+    Returns the values as a float64 array, rounded as the POLICY says for
+    their kind. If report is given, an estimate of the JSON bytes saved
+    is added to it.
+
+    >>> from collections import Counter
+    >>> report = Counter()
+    >>> xy = np.array([[-973.1007212121212, -885.2674060606059]])
+    >>> round_values(xy, 'position', report).tolist()
+    [[-973.1, -885.27]]
+    >>> report['position']
+    23
+    >>> tsne = np.array([-58.13238525390625, 5.219181], dtype=np.float32)
+    >>> round_values(tsne, 'embedding').tolist()
+    [-58.1324, 5.2192]
+    >>> round_values([0.98765, 1.2345e-05, np.nan], 'score').tolist()
+    [0.99, 1.2e-05, nan]
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    (style, digits) = POLICY[kind]
+    if style == 'decimals':
+        rounded = np.round(values, digits)
+    else:
+        rounded = format_values(values, kind).astype(np.float64)
+    if report is not None:
+        report[kind] += _saved(values, rounded)
+    return rounded
+
+
+def format_values(values, kind):
+    '''
+    Returns the values as an array of strings, rounded as the POLICY says
+    for their kind, and formatted as '{:.2g}' would for 2 significant digits.
+
+    >>> format_values([0.98765, 1.2345e-05, np.nan], 'score').tolist()
+    ['0.99', '1.2e-05', 'nan']
+    >>> format_values([1.005, 2], 'position').tolist()
+    ['1.00', '2.00']
+    '''
+    (style, digits) = POLICY[kind]
+    template = '%.{}{}'.format(digits, 'f' if style == 'decimals' else 'g')
+    return np.char.mod(template, np.asarray(values, dtype=np.float64))
+
+
+def summary(report):
+    '''
+    Describes the bytes saved for each kind of value.
+
+    >>> from collections import Counter
+    >>> summary(Counter({'embedding': 2048, 'position': 100}))
+    'Rounding saved 2148 bytes: embedding 2048, position 100'
+    '''
+    return 'Rounding saved {} bytes: {}'.format(
+        sum(report.values()),
+        ', '.join(
+            '{} {}'.format(kind, saved)
+            for (kind, saved) in sorted(report.items())
+        )
+    )
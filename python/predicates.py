@@ -0,0 +1,146 @@
+import numpy as np
+
+# Largest coordinate difference for which the determinants below
+# cannot overflow int64: incircle sums three products of two terms,
+# each up to 2 * diff**2, so 12 * diff**4 < 2**63.
+INT64_ORIENT_LIMIT = 2 ** 30
+INT64_INCIRCLE_LIMIT = 2 ** 14
+# Above that, floats decide the sign unless the determinant is within
+# this relative error bound (Shewchuk's iccerrboundA) of zero, as long
+# as the differences themselves are exact in float64.
+FLOAT_EXACT_LIMIT = 2 ** 53
+INCIRCLE_ERROR_BOUND = (10 + 96 * 2 ** -53) * 2 ** -53
+
+
+def _differences(points, origin, limit):
+    '''
+    Coordinates relative to origin. Integer input stays exact:
+    int64 when the differences are small enough for the determinant,
+    and Python ints otherwise.
+
+    >>> _differences(np.array([[3, 4]]), np.array([[1, 1]]), 10)
+    array([[2, 3]])
+    >>> _differences(np.array([[3, 4]]), np.array([[1, 1]]), 2).dtype
+    dtype('O')
+    >>> _differences(np.array([[3., 4.]]), np.array([[1., 1.]]), 2)
+    array([[2., 3.]])
+    '''
+    if not np.issubdtype(points.dtype, np.integer):
+        return points.astype(np.float64) - origin
+    diff = points.astype(np.int64) - origin.astype(np.int64)
+    if diff.size and np.abs(diff).max() >= limit:
+        diff = diff.astype(object)
+    return diff
+
+
+def orient2d(a, b, c):
+    '''
+    Twice the signed area of each triangle (a[i], b[i], c[i]):
+    Positive if counter-clockwise, negative if clockwise, zero if collinear.
+    Each argument is an (n, 2) array of coordinates.
+
+    >>> a = np.array([[0, 0], [0, 0], [0, 0]])
+    >>> b = np.array([[1, 0], [0, 1], [1, 1]])
+    >>> c = np.array([[0, 1], [1, 0], [2, 2]])
+    >>> orient2d(a, b, c)
+    array([ 1, -1,  0])
+    '''
+    a = np.asarray(a)
+    b = _differences(np.asarray(b), a, INT64_ORIENT_LIMIT)
+    c = _differences(np.asarray(c), a, INT64_ORIENT_LIMIT)
+    return b[:, 0] * c[:, 1] - b[:, 1] * c[:, 0]
+
+
+def incircle(a, b, c, d):
+    '''
+    Positive if d[i] is inside the circle through the counter-clockwise
+    triangle (a[i], b[i], c[i]), negative if outside, and zero if all four
+    points are on the circle. Each argument is an (n, 2) array of coordinates.
+    This is the determinant itself, except for large integer coordinates,
+    where clear cases are only reported by their sign.
+
+    >>> a = np.array([[0, 0], [0, 0], [0, 0]])
+    >>> b = np.array([[2, 0], [2, 0], [2, 0]])
+    >>> c = np.array([[0, 2], [0, 2], [0, 2]])
+    >>> d = np.array([[1, 1], [2, 2], [3, 3]])
+    >>> incircle(a, b, c, d)
+    array([  8,   0, -24])
+
+    With integer coordinates the result is exact. Here the fourth point is
+    just outside the circle, but float64 rounding puts it on the circle:
+
+    >>> big = 10 ** 8
+    >>> a = np.array([[0, 0]])
+    >>> b = np.array([[2 * big, 0]])
+    >>> c = np.array([[0, 2 * big]])
+    >>> d = np.array([[2 * big - 1, 2 * big + 1]])
+    >>> incircle(a, b, c, d)
+    array([-80000000000000000], dtype=object)
+    >>> incircle(a * 1., b * 1., c * 1., d * 1.)
+    array([0.])
+    '''
+    d = np.asarray(d)
+    a = _differences(np.asarray(a), d, INT64_INCIRCLE_LIMIT)
+    b = _differences(np.asarray(b), d, INT64_INCIRCLE_LIMIT)
+    c = _differences(np.asarray(c), d, INT64_INCIRCLE_LIMIT)
+    if object not in (a.dtype, b.dtype, c.dtype):
+        return _incircle(a, b, c)
+    # Too large for int64: filter with floats, and only redo the
+    # uncertain cases with Python ints.
+    a, b, c = a.astype(object), b.astype(object), c.astype(object)
+    if max(np.abs(x).max() for x in (a, b, c)) >= FLOAT_EXACT_LIMIT:
+        return _incircle(a, b, c)
+    det, permanent = _incircle(
+        a.astype(np.float64), b.astype(np.float64), c.astype(np.float64),
+        permanent=True
+    )
+    uncertain = np.abs(det) <= INCIRCLE_ERROR_BOUND * permanent
+    det = np.sign(det).astype(np.int64).astype(object)
+    det[uncertain] = _incircle(a[uncertain], b[uncertain], c[uncertain])
+    return det
+
+
+def incircle_error(a, b, c, d):
+    '''
+    A bound on the rounding error of incircle, as Shewchuk's iccerrboundA
+    gives it: Where the determinant is smaller than this, even its sign
+    is uncertain. Zero for integer coordinates, where it is exact.
+
+    The corners of a square are on one circle, but not after rounding:
+
+    >>> a = np.array([[0.1, 0.1]])
+    >>> b = np.array([[0.2, 0.1]])
+    >>> c = np.array([[0.2, 0.2]])
+    >>> d = np.array([[0.1, 0.2]])
+    >>> incircle(a, b, c, d) != 0
+    array([ True])
+    >>> np.abs(incircle(a, b, c, d)) <= incircle_error(a, b, c, d)
+    array([ True])
+    >>> incircle_error(*(np.round(x * 10).astype(int) for x in (a, b, c, d)))
+    array([0])
+    '''
+    arrays = [np.asarray(x) for x in (a, b, c, d)]
+    if all(np.issubdtype(x.dtype, np.integer) for x in arrays):
+        return np.zeros(len(arrays[0]), dtype=np.int64)
+    (a, b, c, d) = (x.astype(np.float64) for x in arrays)
+    _, permanent = _incircle(a - d, b - d, c - d, permanent=True)
+    return INCIRCLE_ERROR_BOUND * permanent
+
+
+def _incircle(a, b, c, permanent=False):
+    adx, ady = a[:, 0], a[:, 1]
+    bdx, bdy = b[:, 0], b[:, 1]
+    cdx, cdy = c[:, 0], c[:, 1]
+    ad = adx * adx + ady * ady
+    bd = bdx * bdx + bdy * bdy
+    cd = cdx * cdx + cdy * cdy
+    det = (adx * (bdy * cd - bd * cdy)
+           - ady * (bdx * cd - bd * cdx)
+           + ad * (bdx * cdy - bdy * cdx))
+    if not permanent:
+        return det
+    return det, (
+        (np.abs(bdx * cdy) + np.abs(cdx * bdy)) * ad
+        + (np.abs(cdx * ady) + np.abs(adx * cdy)) * bd
+        + (np.abs(adx * bdy) + np.abs(bdx * ady)) * cd
+    )
@@ -1,45 +1,192 @@
 #!/usr/bin/env python3
 
-import json
+import sys
 import numpy as np
 import pandas as pd
-from collections import defaultdict
-from cell_reader import octagon, get_genes
+from collections import Counter, namedtuple
+from scipy import sparse
+from cell_reader import get_genes
+from json_writer import write_json
+from molecules import (
+    write_density_zarr, write_molecules_zarr, write_tiles_zarr
+)
+from polygons import OCTAGON_BOUNDS, bounding_octagons
+from precision import round_values, summary
 import argparse
 
+# Rows of the CSV to parse at once.
+CHUNK_SIZE = 1000000
 
-def cells_dict(df):
-    cells_dict = {}
-    genes_pair_list = defaultdict(list)
-    xy_dict = defaultdict(list)
+Molecules = namedtuple(
+    'Molecules', ['cells', 'counts', 'genes', 'codes', 'xy']
+)
+
+
+def read_molecules(csv_file, chunk_size=CHUNK_SIZE, keep_molecules=True):
+    '''
+    Reads the CSV once, a chunk at a time, and returns:
+    - cells: For each cell, in order of its first molecule, the
+      OCTAGON_BOUNDS of its molecules, and their "sum_x", "sum_y",
+      and "count".
+    - counts: The number of molecules of each gene in each cell,
+      indexed by cell and gene.
+    - genes: The genes, in order of their first molecule.
+    - codes, xy: If keep_molecules, the index of the gene, and [x, y],
+      of each molecule, in order.
+    Only these are kept from chunk to chunk: Without the molecules,
+    memory depends on the number of cells and genes, not of molecules.
 
-    df_genes = df.groupby(['cell', 'gene1']).size().reset_index(name='count')
+    >>> import io
+    >>> csv_file = io.StringIO("""x,y,gene1,gene2,cell
+    ... 1.5,0,B,B,2
+    ... 0,2,A,A,2
+    ... 2,3.5,B,B,2
+    ... 4,4,C,C,1
+    ... """)
+    >>> molecules = read_molecules(csv_file, chunk_size=2)
+    >>> molecules.cells.index.tolist()
+    [2, 1]
+    >>> molecules.cells[['min_x', 'max_diff', 'sum_x', 'count']].values
+    array([[0. , 2. , 3.5, 3. ],
+           [4. , 0. , 4. , 1. ]])
+    >>> molecules.counts.to_dict()
+    {(1, 'C'): 1, (2, 'A'): 1, (2, 'B'): 2}
+    >>> molecules.genes
+    ['B', 'A', 'C']
+    >>> molecules.codes.tolist()
+    [0, 1, 0, 2]
+    '''
+    cell_parts = []
+    count_parts = []
+    genes = []
+    gene_codes = {}
+    code_parts = []
+    xy_parts = []
+    for chunk in pd.read_csv(
+            csv_file, usecols=['x', 'y', 'gene1', 'cell'],
+            chunksize=chunk_size):
+        # As in PolygonStore.bounds, vertices are truncated first.
+        x = chunk['x'].values.astype(np.int64)
+        y = chunk['y'].values.astype(np.int64)
+        reductions = pd.DataFrame({
+            'cell': chunk['cell'].values,
+            'x': x, 'y': y, 'sum': x + y, 'diff': y - x,
+            'sum_x': chunk['x'].values, 'sum_y': chunk['y'].values
+        }).groupby('cell', sort=False)
+        extremes = reductions[['x', 'y', 'sum', 'diff']].agg(['min', 'max'])
+        extremes.columns = OCTAGON_BOUNDS
+        cell_parts.append(pd.concat([
+            extremes,
+            reductions[['sum_x', 'sum_y']].sum(),
+            reductions.size().rename('count')
+        ], axis=1))
+        count_parts.append(chunk.groupby(['cell', 'gene1']).size())
 
-    for index, row in df_genes.iterrows():
-        genes_pair_list[row['cell']].append((row['gene1'], row['count']))
+        (codes, uniques) = pd.factorize(chunk['gene1'])
+        for gene in uniques:
+            if gene not in gene_codes:
+                gene_codes[gene] = len(genes)
+                genes.append(gene)
+        if keep_molecules:
+            recoded = np.array([gene_codes[gene] for gene in uniques])
+            code_parts.append(recoded[codes])
+            xy_parts.append(chunk[['x', 'y']].values)
+
+    # Each cell's parts are combined, in order of its first chunk.
+    cells = pd.concat(cell_parts).groupby(level=0, sort=False).agg(dict(
+        [(name, name[:3]) for name in OCTAGON_BOUNDS]
+        + [(name, 'sum') for name in ['sum_x', 'sum_y', 'count']]
+    ))
+    cells.index.name = 'cell'
+    counts = pd.concat(count_parts).groupby(level=[0, 1]).sum()
+    return Molecules(
+        cells, counts, genes,
+        np.concatenate(code_parts) if code_parts else None,
+        np.concatenate(xy_parts) if xy_parts else None
+    )
 
-    for index, row in df.iterrows():
-        xy_dict[row['cell']].append([row['x'], row['y']])
 
-    for cell in xy_dict:
+def cells_dict(cells, counts, report=None):
+    '''
+    Returns the genes, position, and bounding octagon of each cell,
+    given the cells and counts from read_molecules.
+    '''
+    cells_dict = {}
+    octagons = bounding_octagons(cells[OCTAGON_BOUNDS].values).tolist()
+    centroids = round_values(
+        cells[['sum_x', 'sum_y']].values / cells[['count']].values,
+        'position', report
+    ).tolist()
+    genes_by_cell = {
+        cell: dict(zip(
+            cell_counts.index.get_level_values('gene1'),
+            cell_counts.values.tolist()
+        ))
+        for (cell, cell_counts) in counts.groupby(level=0, sort=False)
+    }
+    for (cell, poly, xy) in zip(cells.index.tolist(), octagons, centroids):
         cells_dict[cell] = {
             "mappings": {},
-            "genes": dict(genes_pair_list[cell]),
-            "xy": list(map(np.mean, zip(*xy_dict[cell]))),
+            "genes": genes_by_cell[cell],
+            "xy": xy,
             "factors": {},
-            "poly": octagon(np.array(xy_dict[cell]))
+            "poly": poly
         }
 
     return cells_dict
 
 
-def molecules_dict(df):
-    molecules_dict = defaultdict(list)
+def genes_matrix(counts, cell_ids):
+    '''
+    Returns the molecule counts as a sparse cells-by-genes matrix,
+    with the IDs of its rows and columns. Cells are in the order given,
+    and genes in the order they are first counted.
+
+    >>> counts = pd.DataFrame({
+    ...   'gene1': ['B', 'A', 'B', 'C'],
+    ...   'cell': [2, 2, 1, 1]
+    ... }).groupby(['cell', 'gene1']).size()
+    >>> matrix, cell_ids, gene_ids = genes_matrix(counts, [2, 1])
+    >>> cell_ids
+    [2, 1]
+    >>> gene_ids
+    ['A', 'B', 'C']
+    >>> matrix.toarray().tolist()
+    [[1, 1, 0], [0, 1, 1]]
+    '''
+    cell_ids = pd.Index(cell_ids)
+    rows = cell_ids.get_indexer(counts.index.get_level_values('cell'))
+    genes = counts.index.get_level_values('gene1')
+    gene_ids = pd.unique(genes[np.argsort(rows, kind='mergesort')])
+    cols = pd.Index(gene_ids).get_indexer(genes)
+    matrix = sparse.coo_matrix(
+        (counts.values, (rows, cols)),
+        shape=(len(cell_ids), len(gene_ids))
+    )
+    return matrix, cell_ids.tolist(), gene_ids.tolist()
+
+
+def molecules_by_gene(genes, codes, xy):
+    '''
+    Returns the [x, y] of each gene's molecules, in order,
+    from one stable sort of the molecules by gene.
+
+    >>> by_gene = molecules_by_gene(
+    ...   ['B', 'A'], np.array([0, 1, 0]), np.array([[1, 2], [3, 4], [5, 6]])
+    ... )
+    >>> {gene: xy.tolist() for (gene, xy) in by_gene.items()}
+    {'B': [[1, 2], [5, 6]], 'A': [[3, 4]]}
+    '''
+    order = np.argsort(codes, kind='mergesort')
+    ends = np.cumsum(np.bincount(codes, minlength=len(genes)))
+    return dict(zip(genes, np.split(xy[order], ends[:-1])))
 
-    for index, row in df.iterrows():
-        molecules_dict[row['gene1']].append([row['x'], row['y']])
 
-    return molecules_dict
+def molecules_dict(by_gene, report=None):
+    return {
+        gene: round_values(xy, 'position', report).tolist()
+        for (gene, xy) in by_gene.items()
+    }
 
 
 def image_dict():
@@ -69,24 +216,63 @@ if __name__ == '__main__':
     parser.add_argument(
         '--molecules_file', type=argparse.FileType('x'),
         help='Create JSON with molecule locations.')
+    parser.add_argument(
+        '--molecules_zarr',
+        help='Write the molecule locations to this zarr store.')
+    parser.add_argument(
+        '--molecules_tiles_zarr',
+        help='Write the molecule locations to this zarr store, '
+             'as a tile pyramid.')
+    parser.add_argument(
+        '--molecules_density_zarr',
+        help='Write the number of molecules of each gene in each pixel '
+             'to this zarr image pyramid.')
     parser.add_argument(
         '--genes_file', type=argparse.FileType('x'),
         help='Write a list of genes to this file.')
     parser.add_argument(
         '--images_file', type=argparse.FileType('x'),
         help='JSON file which will include image location.')
+    parser.add_argument(
+        '--chunk_size', type=int, default=CHUNK_SIZE,
+        help='Number of rows of the CSV to read at once.')
     args = parser.parse_args()
 
+    keep_molecules = bool(
+        args.molecules_file or args.molecules_zarr
+        or args.molecules_tiles_zarr or args.molecules_density_zarr
+    )
     with open(args.csv_file) as csv_file:
-        df = pd.read_csv(csv_file)
-
-    metadata = cells_dict(df)
+        molecules = read_molecules(csv_file, args.chunk_size, keep_molecules)
+    if keep_molecules:
+        by_gene = molecules_by_gene(
+            molecules.genes, molecules.codes, molecules.xy
+        )
 
+    report = Counter()
     if args.cells_file:
-        json.dump(metadata, args.cells_file, indent=1)
+        write_json(
+            cells_dict(molecules.cells, molecules.counts, report),
+            args.cells_file, indent=1
+        )
     if args.molecules_file:
-        json.dump(molecules_dict(df), args.molecules_file, indent=1)
+        write_json(
+            molecules_dict(by_gene, report), args.molecules_file, indent=1
+        )
+    if args.molecules_zarr:
+        write_molecules_zarr(args.molecules_zarr, by_gene.items)
+    if args.molecules_tiles_zarr:
+        write_tiles_zarr(args.molecules_tiles_zarr, by_gene.items)
+    if args.molecules_density_zarr:
+        write_density_zarr(args.molecules_density_zarr, by_gene.items)
     if args.genes_file:
-        json.dump(get_genes(metadata), args.genes_file, indent=1)
+        write_json(
+            get_genes(*genes_matrix(
+                molecules.counts, molecules.cells.index
+            )),
+            args.genes_file, indent=1
+        )
     if args.images_file:
-        json.dump(image_dict(), args.images_file, indent=1)
+        write_json(image_dict(), args.images_file, indent=1)
+
+    print(summary(report), file=sys.stderr)
@@ -0,0 +1,37 @@
+import numpy as np
+
+
+def write_arrays(group, arrays, chunks=None):
+    '''
+    Write each (name, array) pair, or each item of a dict, to the zarr
+    group, uncompressed. By default each array is a single chunk, so that
+    a client can read any part of it as one byte range of one file;
+    otherwise chunks is the largest chunk shape.
+
+    >>> import zarr
+    >>> group = zarr.group()
+    >>> write_arrays(group, {
+    ...     'coords': np.zeros((3, 2), dtype='<f4'),
+    ...     'offsets': np.zeros(0, dtype='<u4')
+    ... })
+    >>> group['coords'].chunks, group['offsets'].chunks
+    ((3, 2), (1,))
+    >>> group['coords'].compressor is None
+    True
+    >>> write_arrays(group, [('matrix', np.zeros((5, 2)))], chunks=(4, 4))
+    >>> group['matrix'].chunks
+    (4, 2)
+    '''
+    if isinstance(arrays, dict):
+        arrays = arrays.items()
+    for (name, data) in arrays:
+        data = np.asarray(data)
+        shape = tuple(max(size, 1) for size in data.shape)
+        group.array(
+            name, data,
+            chunks=shape if chunks is None else tuple(
+                min(chunk, size) for (chunk, size) in zip(chunks, shape)
+            ),
+            # zarr.js does not support compression yet
+            compressor=None
+        )
@@ -17,6 +17,9 @@ main() {
     add_CLI_ARGS 'cells' 'dries'
     add_CLI_ARGS 'cell-sets' 'dries'
     add_CLI_ARGS 'factors' 'dries'
+    POLYGONS_OUT="$OUTPUT/dries.polygons.zarr"
+    [ -e "$POLYGONS_OUT" ] || \
+        CLI_ARGS="$CLI_ARGS --polygons_zarr $POLYGONS_OUT"
 
     echo "Download and process cells..."
 
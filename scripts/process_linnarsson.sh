@@ -36,6 +36,16 @@ process_linnarson_cells() {
     add_CLI_ARGS 'neighborhoods' 'linnarsson'
     add_CLI_ARGS 'factors' 'linnarsson'
 
+    ZARR_OUT="$OUTPUT/linnarsson.neighborhoods.zarr"
+    [ -e "$ZARR_OUT" ] || \
+        CLI_ARGS="$CLI_ARGS --neighborhoods_zarr $ZARR_OUT --neighborhoods_adjacency"
+    POLYGONS_OUT="$OUTPUT/linnarsson.polygons.zarr"
+    [ -e "$POLYGONS_OUT" ] || \
+        CLI_ARGS="$CLI_ARGS --polygons_zarr $POLYGONS_OUT"
+    CLUSTERS_OUT="$OUTPUT/linnarsson.clusters.zarr"
+    [ -e "$CLUSTERS_OUT" ] || \
+        CLI_ARGS="$CLI_ARGS --clusters_zarr $CLUSTERS_OUT"
+
     echo "Download and process cells..."
 
     [ -e "$LOOM_IN" ] || \
@@ -75,6 +85,38 @@ process_linnarson_molecules() {
         echo "Running: $CMD"
         eval $CMD
     fi
+
+    ZARR_OUT="$OUTPUT/linnarsson.molecules.zarr"
+    if [ -e "$ZARR_OUT" ]
+    then
+        echo "Skipping molecules -- output already exists: $ZARR_OUT"
+    else
+        CMD="$BASE/python/counts_hdf5_reader.py --hdf5 $HDF5_IN --zarr $ZARR_OUT"
+        echo "Running: $CMD"
+        eval $CMD
+    fi
+
+    TILES_OUT="$OUTPUT/linnarsson.molecules-tiles.zarr"
+    if [ -e "$TILES_OUT" ]
+    then
+        echo "Skipping molecules -- output already exists: $TILES_OUT"
+    else
+        CMD="$BASE/python/counts_hdf5_reader.py --hdf5 $HDF5_IN"
+        CMD="$CMD --tiles_zarr $TILES_OUT"
+        echo "Running: $CMD"
+        eval $CMD
+    fi
+
+    DENSITY_OUT="$OUTPUT/linnarsson.molecules-density.zarr"
+    if [ -e "$DENSITY_OUT" ]
+    then
+        echo "Skipping molecules -- output already exists: $DENSITY_OUT"
+    else
+        CMD="$BASE/python/counts_hdf5_reader.py --hdf5 $HDF5_IN"
+        CMD="$CMD --density_zarr $DENSITY_OUT"
+        echo "Running: $CMD"
+        eval $CMD
+    fi
 }
 
 process_linnarson_images() {
@@ -19,6 +19,15 @@ main() {
     add_CLI_ARGS 'molecules' 'wang'
     add_CLI_ARGS 'genes' 'wang'
     add_CLI_ARGS 'images' 'wang'
+    MOLECULES_OUT="$OUTPUT/wang.molecules.zarr"
+    [ -e "$MOLECULES_OUT" ] || \
+        CLI_ARGS="$CLI_ARGS --molecules_zarr $MOLECULES_OUT"
+    TILES_OUT="$OUTPUT/wang.molecules-tiles.zarr"
+    [ -e "$TILES_OUT" ] || \
+        CLI_ARGS="$CLI_ARGS --molecules_tiles_zarr $TILES_OUT"
+    DENSITY_OUT="$OUTPUT/wang.molecules-density.zarr"
+    [ -e "$DENSITY_OUT" ] || \
+        CLI_ARGS="$CLI_ARGS --molecules_density_zarr $DENSITY_OUT"
 
     echo "Download and process cells..."
 
@@ -1,6 +1,7 @@
 import argparse
+import sys
+from pathlib import Path
 
-import json
 import pyarrow as pa
 import pandas as pd
 
@@ -13,6 +14,12 @@ from utils import (
     merge_cell_sets_trees
 )
 
+# The factor encoding is shared with the readers in python/.
+sys.path.append(str(Path(__file__).resolve().parents[3] / 'python'))
+from factor_encoder import get_factor  # noqa: E402
+from json_writer import write_json  # noqa: E402
+from precision import format_values  # noqa: E402
+
 
 def generate_json_files(
     input_cells_arrow_file, input_annotations_csv_file, input_cl_obo_file,
@@ -30,6 +37,10 @@ def generate_json_files(
     df[COLUMNS.ANNOTATION.value] = df[COLUMNS.ANNOTATION.value].astype(str)
 
     cells_df_items = df.T.to_dict().items()
+    # Formatted all at once, with the digits of the shared policy.
+    scores = dict(zip(df.index, format_values(
+        df[COLUMNS.PREDICTION_SCORE.value].values, 'score'
+    ).tolist()))
 
     # Generate .cells.json
     cells = {
@@ -38,31 +49,23 @@ def generate_json_files(
             "factors": {
                 "Leiden Clustering": v['leiden'],
                 "Cell Type Annotation": v[COLUMNS.ANNOTATION.value],
-                "Cell Type Annotation Prediction Score":
-                    '{:.2g}'.format(v[COLUMNS.PREDICTION_SCORE.value])
+                "Cell Type Annotation Prediction Score": scores[k]
             }
         }
         for (k, v) in cells_df_items
     }
     with open(output_cells_json_file, 'w') as f:
-        json.dump(cells, f, indent=1)
+        write_json(cells, f, indent=1)
 
     # Generate data for .factors.json
     def get_factors(col_name):
-        unique_values = sorted(df[col_name].unique().tolist())
-        return {
-            "map": unique_values,
-            "cells": {
-                k: unique_values.index(v[col_name])
-                for (k, v) in cells_df_items
-            }
-        }
+        return get_factor(df.index.tolist(), df[col_name].values, sort=True)
     factors = {
         "Leiden Clustering": get_factors('leiden'),
         "Cell Type Annotation": get_factors(COLUMNS.ANNOTATION.value)
     }
     with open(output_factors_json_file, 'w') as f:
-        json.dump(factors, f, indent=1)
+        write_json(factors, f, indent=1)
 
     # Remove annotations with NaN prediction scores
     df = df.dropna(subset=[COLUMNS.PREDICTION_SCORE.value], axis=0)
@@ -83,7 +86,7 @@ def generate_json_files(
     )
 
     with open(output_cell_sets_json_file, 'w') as f:
-        json.dump(cell_sets, f, indent=1)
+        write_json(cell_sets, f, indent=1)
 
 
 if __name__ == '__main__':
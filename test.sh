@@ -31,11 +31,6 @@ end doctest
 start endtoend
 rm -rf fake-files/output || echo 'Nothing to delete'
 mkdir fake-files/output || echo 'Did not mkdir'
-mkdir fake-files/output/linnarsson || echo 'Did not mkdir'
-
-cp fake-files/output{-expected,}/linnarsson/linnarsson.neighborhoods.json
-# Calculating neightborhoods is slow, and not a requirement right now,
-# so copy over the expected output, and it will not be regenerated.
 
 CI=true ./process.sh
 # CI to get it to run as test locally;